@@ -1,10 +1,596 @@
 # from Generate_gcode.preview import GCodePreview
+import bisect
+import hashlib
+import json
 import os
 import re
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+# Characters whose glyph file can not be named after the character itself
+GLYPH_NAMES = {".": "dot", ":": "ddot", "/": "slash", "\\": "backslash"}
+# Machine set up and shut down, emitted once around every generated program
+PROLOGUE = "G00 G17 G40 G21 G54\nM4\n"
+EPILOGUE = "G1 S0\nM5\nM2"
+# Scan line distance of the LightBurn glyphs in mm
+LINE_INTERVAL = 0.05
+# Bump when the layout of the glyph index or its parsed values change
+INDEX_VERSION = 1
+
+
+def parse_glyph(gcode):
+    """Returns [x_max, y_offset] of a LightBurn glyph program.
+
+    x_max is the right-most x position reached while the laser is burning,
+    y_offset the y of the first rapid move, which places the glyph on the
+    base line.
+    """
+    x_max, x = 0, 0
+    y_offset, y = 0, 0
+    abs_mode = True
+    power_on = False
+    first_y = True
+    s_value = 0
+    lines = gcode.strip().split("\n")
+    for line in lines:
+        if line.startswith(";") or not line.strip():
+            continue
+
+        if line.startswith("G90"):
+            abs_mode = True
+        elif line.startswith("G91"):
+            abs_mode = False
+        elif line.startswith("M3") or line.startswith("M4"):
+            power_on = True
+        elif line.startswith("M5"):
+            power_on = False
+
+        if line.startswith(("G0", "G00", "G1", "G01")):
+            matches = re.findall(
+                r"X([-+]?[0-9]*\.?[0-9]+)|Y([-+]?[0-9]*\.?[0-9]+)|S([0-9]+)",
+                line,
+            )
+            for match in matches:
+                if match[0]:
+                    x_new = float(match[0])
+                    x = x_new if abs_mode else x + x_new
+                if match[1]:
+                    y_new = float(match[1])
+                    if line.startswith(("G0", "G00")) and first_y:
+                        y_offset = y_new
+                        first_y = False
+                    y = y_new if abs_mode else y + y_new
+                if match[2]:
+                    s_value = int(match[2])
+
+            if line.startswith(("G0", "G00")):
+                pass
+            elif power_on and (s_value is None or s_value > 0):
+                x_max = x if x > x_max else x_max
+    return [round(x_max, 3), round(y_offset, 3)]
+
+
+def origin_gcode(offset):
+    """Absolute move to the card origin, switching to relative moves after."""
+    return (
+        "G90\nG1 X"
+        + str(round(offset[0], 3))
+        + "Y"
+        + str(round(offset[1], 3))
+        + "F5000S0\nG91\n"
+    )
+
+
+def clean_gcode(gcode):
+    """Strips the set up and shut down lines LightBurn puts in every file."""
+    gcode = gcode.replace("M2\n", "")
+    # gcode = gcode.replace('M4\n', '')
+    # gcode = gcode.replace('M5\n', '')
+    gcode = gcode.replace("M8\n", "")
+    gcode = gcode.replace("M9\n", "")
+    return gcode.replace("G00 G17 G40 G21 G54\n", "")
+
+
+def format_number(value):
+    """Formats a coordinate with at most 3 decimals and no trailing zeros."""
+    text = ("%.3f" % value).rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def font_key(font):
+    """The name of a font size as in Letters/, 4.0 and "4.0" are "4"."""
+    return "%g" % float(font)
+
+
+def compact_gcode(gcode):
+    """Shortens a LightBurn program without changing its tool path.
+
+    Comments and blank lines are dropped, consecutive relative moves in the
+    same direction with the same G word, feed and power are merged into one
+    and G, F and S words are only written when they change, as are relative
+    axes that do not move. The modal state
+    is unknown at the start of the program, so its first move stays complete.
+    """
+    lines = []
+    relative = False
+    state = {"G": None, "F": None, "S": None}  # modal words read so far
+    written = {"G": None, "F": None, "S": None}  # modal words sent so far
+    pending = None  # [g, x, y, f, s] of the move currently being merged
+
+    def emit(g, x, y, f, s):
+        line = ""
+        for word, value in (("G", g), ("X", x), ("Y", y), ("F", f), ("S", s)):
+            if value is None:
+                continue
+            if word in written:
+                if written[word] == value:
+                    continue
+                written[word] = value
+            elif relative and value == 0:
+                continue
+            if word == "G":
+                line += "G" + value + " "
+            else:
+                line += word + format_number(value)
+        if line.strip():
+            lines.append(line.strip())
+
+    def flush():
+        nonlocal pending
+        if pending is not None:
+            emit(*pending)
+            pending = None
+
+    for line in gcode.split("\n"):
+        line = line.strip()
+        if not line or line.startswith(";"):
+            continue
+        move = re.fullmatch(
+            r"(?:G0?([01])(?![0-9]))?\s*((?:[XYFS][-+]?[0-9]*\.?[0-9]+)*)", line
+        )
+        if not move or not (move.group(1) or move.group(2)):
+            flush()
+            if line in ("G90", "G91"):
+                relative = line == "G91"
+            elif not line.startswith(("M3", "M4", "M5")):
+                # Unknown block, the modal state may have changed
+                state = {"G": None, "F": None, "S": None}
+                written.update(state)
+            lines.append(line)
+            continue
+
+        words = dict(re.findall(r"([XYFS])([-+]?[0-9]*\.?[0-9]+)", move.group(2)))
+        if move.group(1):
+            state["G"] = move.group(1)
+        for word in "FS":
+            if word in words:
+                state[word] = float(words[word])
+        x = float(words["X"]) if "X" in words else None
+        y = float(words["Y"]) if "Y" in words else None
+        if state["G"] is None or (x is None and y is None):
+            flush()
+            emit(state["G"], None, None, state["F"], state["S"])
+            continue
+
+        current = [state["G"], x, y, state["F"], state["S"]]
+        if (
+            relative
+            and pending is not None
+            and pending[0] == current[0]
+            and pending[3:] == current[3:]
+            and _same_direction(pending[1:3], current[1:3])
+        ):
+            pending[1] = _add(pending[1], x)
+            pending[2] = _add(pending[2], y)
+            continue
+        flush()
+        pending = current
+    flush()
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def _add(a, b):
+    if a is None and b is None:
+        return None
+    return round((a or 0) + (b or 0), 3)
+
+
+def _same_direction(a, b):
+    ax, ay = a[0] or 0, a[1] or 0
+    bx, by = b[0] or 0, b[1] or 0
+    return abs(ax * by - ay * bx) < 1e-9 and ax * bx + ay * by > 0
+
+
+def burn_segments(moves, y_offset=0):
+    """Returns the burning moves of a relative glyph as [x0, y0, x1, y1, s].
+
+    Coordinates are relative to the pen position add_text leaves before
+    the glyph, which is y_offset above the start of the glyph program.
+    """
+    segments = []
+    x, y = 0.0, -y_offset
+    s_value = 0
+    for g, dx, dy, s, f in moves:
+        if s is not None:
+            s_value = s
+        x1, y1 = round(x + (dx or 0), 3), round(y + (dy or 0), 3)
+        if g == 1 and s_value > 0 and (x1, y1) != (x, y):
+            segments.append([x, y, x1, y1, s_value])
+        x, y = x1, y1
+    return segments
+
+
+def scan_gcode(segments, feed=4000):
+    """Engraves burn segments as a relative scan, back at the start after.
+
+    Segments on the same y are engraved as one row, rows alternate their
+    direction like the LightBurn scans do.
+    """
+    rows = {}
+    for segment in segments:
+        rows.setdefault(segment[1], []).append(segment)
+    lines = ["G91", "M4"]
+    x, y = 0.0, 0.0
+    first = True
+
+    def move_to(x1, y1, s):
+        nonlocal x, y, first
+        dx, dy = round(x1 - x, 3), round(y1 - y, 3)
+        if dx or dy:
+            line = "G1 X" + format_number(dx) + "Y" + format_number(dy)
+            if first:
+                line += "F" + str(feed)
+                first = False
+            lines.append(line + "S" + format_number(s))
+        x, y = x1, y1
+
+    for n, row_y in enumerate(sorted(rows)):
+        row = sorted(rows[row_y], key=lambda segment: min(segment[0], segment[2]))
+        if n % 2:
+            row.reverse()
+        for x0, y0, x1, y1, s in row:
+            if (x1 < x0) != bool(n % 2) and y0 == y1:
+                x0, x1 = x1, x0
+            move_to(x0, y0, 0)
+            move_to(x1, y1, s)
+    lines.append("M5")
+    lines.append("G0 X" + format_number(-x) + "Y" + format_number(-y))
+    return "\n".join(lines) + "\n"
+
+
+def parse_moves(gcode):
+    """Returns the motion lines of a glyph program as [g, x, y, s, f] lists.
+
+    g is 0 for rapid and 1 for linear moves, words missing on the line
+    are None. Lines without any of these words only set modal state and
+    are skipped.
+    """
+    moves = []
+    for line in gcode.split("\n"):
+        code = re.match(r"G0?([01])(?![0-9])", line.strip())
+        if not code:
+            continue
+        words = dict(re.findall(r"([XYSF])([-+]?[0-9]*\.?[0-9]+)", line))
+        if not words:
+            continue
+        moves.append(
+            [int(code.group(1))]
+            + [float(words[w]) if w in words else None for w in "XYSF"]
+        )
+    return moves
+
+
+class Glyph_Atlas:
+    """In-memory store of the glyphs in Letters/<font size>/.
+
+    Every font size is read from disk and measured once, on first use.
+    A glyph is a dict with its G-code body, cleaned by clean_gcode and
+    unless disabled shortened by compact_gcode, x_max, y_offset and moves.
+
+    Font sizes without a folder, and every size at another line interval,
+    are scaled by scale_font from the burn segments of the largest
+    exported font that has the character. The last max_scaled scaled
+    sizes are kept.
+
+    If index_path is given, the measurements are persisted there as JSON,
+    keyed by file name, mtime and SHA-1 of every glyph file. Only glyphs
+    whose file changed are parsed again on the next start.
+    """
+
+    def __init__(self, path, index_path=None, compact=True, max_scaled=8):
+        self.path = path
+        self.index_path = index_path
+        self.compact = compact
+        self.max_scaled = max_scaled
+        self._fonts = {}
+        self._scaled = OrderedDict()
+        self._outlines = None
+        self._metrics = {}
+        self._index = None
+        self._lock = threading.RLock()
+
+    def get_font(self, font, interval=LINE_INTERVAL):
+        font = font_key(font)
+        if interval != LINE_INTERVAL or not os.path.isdir(self.path + font):
+            return self.scale_font(font, interval)
+        if font in self._fonts:
+            return self._fonts[font]
+        with self._lock:
+            if font not in self._fonts:
+                self._fonts[font] = self._load_font(font)
+        return self._fonts[font]
+
+    def get_sizes(self):
+        """The font sizes exported to Letters/, smallest first."""
+        sizes = [f for f in os.listdir(self.path) if os.path.isdir(self.path + f)]
+        return sorted(sizes, key=float)
+
+    def scale_font(self, font, interval=LINE_INTERVAL):
+        """Returns the glyphs of any font size, scanned every interval mm."""
+        key = (font_key(font), interval)
+        with self._lock:
+            if key in self._scaled:
+                self._scaled.move_to_end(key)
+                return self._scaled[key]
+            glyphs = {}
+            for name, (size, segments) in self._get_outlines().items():
+                glyphs[name] = self._scale_glyph(
+                    segments, float(font) / float(size), interval
+                )
+            self._scaled[key] = glyphs
+            while len(self._scaled) > self.max_scaled:
+                old, _ = self._scaled.popitem(last=False)
+                self._metrics.pop(old, None)
+            return glyphs
+
+    def _get_outlines(self):
+        # One outline per character, taken from the largest font that has it
+        if self._outlines is None:
+            outlines = {}
+            for size in self.get_sizes():
+                for name, glyph in self.get_font(size).items():
+                    segments = burn_segments(glyph["moves"], glyph["y_offset"])
+                    outlines[name] = (size, segments)
+            self._outlines = outlines
+        return self._outlines
+
+    def _scale_glyph(self, segments, scale, interval):
+        rows = {}
+        scaled = []
+        for x0, y0, x1, y1, s in segments:
+            if y0 == y1:
+                rows.setdefault(y0, []).append([x0, x1, s])
+            else:
+                scaled.append([round(v * scale, 3) for v in (x0, y0, x1, y1)] + [s])
+        if rows:
+            # Every new scan line takes the nearest line of the outline,
+            # unless it falls in a gap between the lines of the outline
+            source = sorted(rows)
+            count = int(round((source[-1] - source[0]) * scale / interval))
+            for n in range(count + 1):
+                y = source[0] + n * interval / scale
+                i = bisect.bisect_left(source, y)
+                if i == len(source) or (i and y - source[i - 1] < source[i] - y):
+                    i -= 1
+                if abs(source[i] - y) > LINE_INTERVAL / 2 + 1e-6:
+                    continue
+                y = round(source[0] * scale + n * interval, 3)
+                for x0, x1, s in rows[source[i]]:
+                    scaled.append([round(x0 * scale, 3), y, round(x1 * scale, 3), y, s])
+        gcode = scan_gcode(scaled)
+        return {
+            "gcode": compact_gcode(gcode) if self.compact else gcode,
+            "x_max": round(max((max(s[0], s[2]) for s in scaled), default=0), 3),
+            "y_offset": 0,
+            "moves": parse_moves(gcode),
+        }
+
+    def get_glyph(self, font, char, interval=LINE_INTERVAL):
+        glyphs = self.get_font(font, interval)
+        name = GLYPH_NAMES.get(char, char)
+        if name not in glyphs and name.upper() in glyphs:
+            # The fonts only have capitals, which case-insensitive file
+            # systems used to serve for lower case letters as well
+            name = name.upper()
+        return glyphs[name]
+
+    def get_metrics(self, font, interval=LINE_INTERVAL):
+        """Returns the x_max of every glyph as an array indexed by code point.
+
+        Code points without a glyph are NaN, the space is 0.
+        """
+        key = (font_key(font), interval)
+        if key not in self._metrics:
+            names = {name: char for char, name in GLYPH_NAMES.items()}
+            glyphs = {
+                names.get(name, name): glyph["x_max"]
+                for name, glyph in self.get_font(font, interval).items()
+            }
+            glyphs = {char: x for char, x in glyphs.items() if len(char) == 1}
+            for char in list(glyphs):
+                if len(char.lower()) == 1:
+                    glyphs.setdefault(char.lower(), glyphs[char])
+            glyphs[" "] = 0.0
+            metrics = np.full(max(map(ord, glyphs)) + 1, np.nan)
+            for char, x_max in glyphs.items():
+                metrics[ord(char)] = x_max
+            self._metrics[key] = metrics
+        return self._metrics[key]
+
+    def _load_font(self, font):
+        index = self._load_index()
+        entries = index["fonts"].get(font, {})
+        fresh = {}
+        glyphs = {}
+        for letter in sorted(os.listdir(self.path + font)):
+            if not letter.endswith(".gc"):
+                continue
+            file_path = self.path + font + "/" + letter
+            with open(file_path, "rb") as file:
+                data = file.read()
+            gcode = data.decode()
+            entry = self._index_entry(
+                entries.get(letter), data, gcode, os.stat(file_path).st_mtime_ns
+            )
+            fresh[letter] = entry
+            gcode = clean_gcode(gcode)
+            glyphs[letter.removesuffix(".gc")] = {
+                "gcode": compact_gcode(gcode) if self.compact else gcode,
+                "x_max": entry["x_max"],
+                "y_offset": entry["y_offset"],
+                "moves": entry["moves"],
+            }
+        if fresh != entries:
+            index["fonts"][font] = fresh
+            self._save_index()
+        return glyphs
+
+    def _index_entry(self, entry, data, gcode, mtime):
+        if entry is not None and entry["mtime"] == mtime:
+            return entry
+        digest = hashlib.sha1(data).hexdigest()
+        if entry is None or entry["sha1"] != digest:
+            x_max, y_offset = parse_glyph(gcode)
+            entry = {
+                "sha1": digest,
+                "x_max": x_max,
+                "y_offset": y_offset,
+                "moves": parse_moves(gcode),
+            }
+        return dict(entry, mtime=mtime)
+
+    def _load_index(self):
+        if self._index is not None:
+            return self._index
+        self._index = {"version": INDEX_VERSION, "fonts": {}}
+        if not self.index_path:
+            return self._index
+        try:
+            with open(self.index_path, "r") as file:
+                index = json.load(file)
+            if index.get("version") == INDEX_VERSION:
+                self._index = index
+        except (OSError, json.JSONDecodeError):
+            pass
+        return self._index
+
+    def _save_index(self):
+        if not self.index_path:
+            return
+        # Workers, the text agent and the server may save at the same time,
+        # each writes its own file and the last replace wins
+        directory, name = os.path.split(os.path.abspath(self.index_path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=name + ".", dir=directory)
+        except OSError as e:
+            print("Glyph index not saved:", e)
+            return
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(self._index, file, separators=(",", ":"))
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print("Glyph index not saved:", e)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+class Template_Registry:
+    """Card templates from Templets/<variant>.gc, each read from disk once.
+
+    Switching between variants only swaps a reference to the cached body,
+    the positioning header is built by Generate_Gcode.set_offset.
+    """
+
+    def __init__(self, path, compact=True):
+        self.path = path
+        self.compact = compact
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def get_template(self, variant):
+        if variant not in self._templates:
+            with self._lock:
+                if variant not in self._templates:
+                    self._templates[variant] = self._load_template(variant)
+        return self._templates[variant]
+
+    def _load_template(self, variant):
+        with open(self.path + variant + ".gc", "r") as file:
+            gcode = clean_gcode(file.read())
+        return compact_gcode(gcode) if self.compact else gcode
+
+    def load_all(self, variants):
+        for variant in variants:
+            self.get_template(variant)
+
+
+class Gcode_Result:
+    """A generated program, kept as the list of chunks it was built from."""
+
+    def __init__(self, variant, offset, chunks):
+        self.variant = variant
+        self.offset = offset
+        self.chunks = chunks
+        self._gcode = None
+
+    def get_gcode(self):
+        if self._gcode is None:
+            self._gcode = "".join(self.chunks)
+        return self._gcode
+
+    def write_gcode(self, filename):
+        with open(filename, "w") as outfile:
+            outfile.writelines(self.chunks)
+
+    def lines(self):
+        """Yields the program line by line without joining it first.
+
+        The lines are the same as get_gcode().split("\\n").
+        """
+        rest = ""
+        for chunk in self.chunks:
+            start = 0
+            end = chunk.find("\n")
+            while end != -1:
+                yield rest + chunk[start:end]
+                rest = ""
+                start = end + 1
+                end = chunk.find("\n", start)
+            rest += chunk[start:]
+        yield rest
+
+    def count_lines(self):
+        """Number of lines that are neither blank nor a comment."""
+        count = 0
+        for line in self.lines():
+            line = line.strip()
+            if line and not line.startswith(";"):
+                count += 1
+        return count
+
+    def extend(self, chunks):
+        """Adds chunks in front of the program end."""
+        self.chunks[-1:-1] = chunks
+        self._gcode = None
 
 
 class Generate_Gcode:
-    def __init__(self, variant="hs", offset=[4, 86]):
+    def __init__(
+        self,
+        variant="hs",
+        offset=[4, 86],
+        compact=True,
+        field_cache_size=256,
+        preload_templates=True,
+    ):
         self._variants = {
             "hs": {
                 "variant": "hs",
@@ -16,6 +602,7 @@ class Generate_Gcode:
                 "fax": ["14", "2.5"],
                 "mail": ["10", "2.5"],
                 "x_offset": "5",
+                "width": "80",
             },
             "blank": {
                 "variant": "blank",
@@ -27,6 +614,7 @@ class Generate_Gcode:
                 "fax": ["14", "2.5"],
                 "mail": ["10", "2.5"],
                 "x_offset": "5",
+                "width": "85.6",
             },
             "hs-simple": {
                 "variant": "hs-simpe",
@@ -34,6 +622,7 @@ class Generate_Gcode:
                 "name": ["20", "4"],
                 "division": ["40.5", "4"],
                 "x_offset": "5",
+                "width": "85.6",
             },
             "zdin": {
                 "variant": "zdin",
@@ -42,6 +631,7 @@ class Generate_Gcode:
                 "phone": ["9.8", "2.5"],
                 "mail": ["6.3", "2.5"],
                 "x_offset": "1.3",
+                "width": "85.6",
             },
             "icps2025": {
                 "variant": "icps2025",
@@ -49,6 +639,7 @@ class Generate_Gcode:
                 "division": ["10", "2.5"],
                 "job_title": ["10", "2.5"],
                 "x_offset": "5",
+                "width": "85.6",
                 },
             "icps2025V2": {
                 "variant": "icps2025V2",
@@ -56,6 +647,7 @@ class Generate_Gcode:
                 "division": ["10", "2.5"],
                 "job_title": ["10", "2.5"],
                 "x_offset": "5",
+                "width": "85.6",
                 },
             "icps2025Blank": {
                 "variant": "icps2025Blank",
@@ -63,6 +655,7 @@ class Generate_Gcode:
                 "division": ["10", "2.5"],
                 "job_title": ["10", "2.5"],
                 "x_offset": "5",
+                "width": "85.6",
                 },
             "icps2025Logo": {
                 "variant": "icps2025Logo",
@@ -70,146 +663,401 @@ class Generate_Gcode:
                 "division": ["10", "2.5"],
                 "job_title": ["10", "2.5"],
                 "x_offset": "5",
+                "width": "85.6",
                 },
         }
         self._fonts = {"4": [1.5, 0.4], "2.5": [0.962, 0.267]}
-        self._gcode_tamplet = ""
-        self._gcode_data = ""
-        self._offset = offset
-        self._variant = variant
+        self._result = Gcode_Result(variant, offset, [])
         self.path = os.path.dirname(os.path.abspath(__file__)) + "/"
+        self._atlas = Glyph_Atlas(
+            self.path + "Letters/",
+            index_path=self.path + "glyph_index.json",
+            compact=compact,
+        )
+        self._templates = Template_Registry(self.path + "Templets/", compact=compact)
+        if preload_templates:
+            self._templates.load_all(self._variants)
+        # Settings a render_sheet worker needs to render fields the same way
+        self._worker_args = (compact, field_cache_size)
+        self._pool = None
+        self._pool_workers = None
+        self._pool_lock = threading.Lock()
+        # Rendered fields by (variant, field, text, offset, auto_fit), so
+        # regenerating a card only renders the fields that changed
+        self._field_cache = lru_cache(maxsize=field_cache_size)(self._render_field)
+        self.set_offset(*offset)
+        self.set_variant(variant)
 
     def set_variant(self, variant: str = ""):
         self._variant = self._variants[variant]
-        self._gcode_tamplet = (
-            "$H\nG90\nG1 X"
-            + str(round(self._offset[0], 3))
-            + "Y"
-            + str(round(self._offset[1], 3))
-            + "F5000S0\nG91\nG1"
-        )
-        with open(self.path + "Templets/" + variant + ".gc", "r") as file:
-            self._gcode_tamplet += file.read()
+        self._variant_name = variant
+
+    @property
+    def _gcode_tamplet(self):
+        return self._templates.get_template(self._variant_name)
 
     def set_offset(self, x, y):
         self._offset = [x, y]
+        self._origin = origin_gcode(self._offset)
+
+    def get_offset(self):
+        return list(self._offset)
 
     def get_gcode(self):
-        return self._gcode_data
+        return self._result.get_gcode()
+
+    def get_result(self):
+        return self._result
+
+    def write_gcode(self, filename):
+        self._result.write_gcode(filename)
 
-    def generate_gcode(self, info: list[str]):
-        if info["variant"] is not self._variant:
+    def generate_gcode(self, info: list[str], auto_fit=False):
+        if info["variant"] != self._variant_name:
             self.set_variant(info["variant"])
-        self._gcode_data = self._gcode_tamplet
+        fields = {i: info[i] for i in info if i != "variant"}
+        self._result = self.render(info["variant"], self._offset, fields, auto_fit)
+
+    def render(self, variant, offset, fields, auto_fit=False):
+        """Renders one card and returns it as a Gcode_Result.
+
+        Unlike generate_gcode, render does not read or change the variant,
+        offset or program of the generator and only shares the read-only
+        glyph, template and field caches, so it can be called from several
+        threads at once.
+        """
+        info = dict(fields, variant=variant)
+        chunks = [PROLOGUE, "$H\n", origin_gcode(offset)]
+        chunks.append(self._templates.get_template(variant))
+        chunks += self.field_chunks(info, offset, auto_fit)
+        chunks.append(EPILOGUE)
+        return Gcode_Result(variant, list(offset), chunks)
+
+    def render_text(self, texts, offset):
+        """Engraves free standing text, without a template, as a Gcode_Result.
+
+        texts is a list of dicts with the baseline "x" and "y" in mm from the
+        card origin, the "text" and its "font_size", and optionally the
+        letter "spacing" and the scan line "interval" of the glyphs. Used
+        for the <text> of SVG layouts.
+        """
+        origin = origin_gcode(offset)
+        chunks = [PROLOGUE, "$H\n"]
+        for text in texts:
+            self.place_text(
+                chunks,
+                origin,
+                text["x"],
+                text["y"],
+                text["text"],
+                text["font_size"],
+                text.get("spacing"),
+                text.get("interval", LINE_INTERVAL),
+            )
+        chunks.append(EPILOGUE)
+        return Gcode_Result("text", list(offset), chunks)
+
+    def generate_sheet(self, records, layout, workers=None, auto_fit=False):
+        self._result = self.render_sheet(records, layout, workers, auto_fit)
+
+    def render_sheet(self, records, layout, workers=None, auto_fit=False):
+        """Engraves one card per tray slot in a single program.
+
+        records is a list of info dicts as taken by generate_gcode, layout
+        the [x, y] card offset of every slot. A None record leaves its slot
+        empty. The machine is homed once for the whole sheet. With workers
+        set, the text of the slots is rendered on a process pool. auto_fit
+        is passed on to field_chunks.
+        """
+        if len(records) > len(layout):
+            raise ValueError(
+                str(len(records)) + " records for " + str(len(layout)) + " slots"
+            )
+        slots = [
+            (info, offset) for info, offset in zip(records, layout) if info
+        ]
+        if workers and len(slots) > 1:
+            fields = list(
+                self._worker_pool(workers).map(
+                    _render_fields,
+                    *zip(*slots),
+                    [auto_fit] * len(slots),
+                )
+            )
+        else:
+            fields = [
+                self.field_chunks(info, offset, auto_fit) for info, offset in slots
+            ]
+
+        chunks = [PROLOGUE, "$H\n"]
+        for (info, offset), text in zip(slots, fields):
+            chunks.append(origin_gcode(offset))
+            chunks.append(self._templates.get_template(info["variant"]))
+            chunks += text
+        chunks.append(EPILOGUE)
+        return Gcode_Result("sheet", None, chunks)
+
+    def _worker_pool(self, workers):
+        """The process pool of render_sheet, kept for later sheets."""
+        with self._pool_lock:
+            if self._pool_workers != workers:
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_worker,
+                    initargs=self._worker_args,
+                )
+                self._pool_workers = workers
+            return self._pool
+
+    def close(self):
+        """Shuts down the process pool of render_sheet, if any."""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+                self._pool_workers = None
+
+    def field_chunks(self, info, offset, auto_fit=False):
+        """Renders the text fields of one card at offset as G-code chunks.
+
+        With auto_fit, the font size and letter spacing of every field are
+        chosen by fit_field, fields that do not fit at all are skipped.
+        """
+        chunks = []
         for i in info:
             if i == "variant" or info[i] == "":
                 continue
             try:
-                self.add_text(i, info[i])
-            except:
+                field = self._field_cache(
+                    info["variant"], i, info[i], tuple(offset), auto_fit
+                )
+            except Exception as e:
+                # Not cached, the next card tries the field again
+                print("Field " + i + " failed: " + repr(e))
                 continue
+            if field is not None:
+                chunks.append(field)
+        return chunks
+
+    def field_cache_info(self):
+        return self._field_cache.cache_info()
 
-        self.clean_up()
+    def _render_field(self, variant, type, text, offset, auto_fit):
+        chunks = []
+        font = [None, None]
+        if auto_fit:
+            font = self.fit_field(variant, type, text)
+            if font is None:
+                print("Field " + type + " does not fit on " + variant)
+                return None
+        try:
+            self._add_text(
+                chunks,
+                self._variants[variant],
+                origin_gcode(offset),
+                type,
+                text,
+                *font,
+            )
+        except KeyError:
+            # A character without a glyph, the field is engraved up to it
+            pass
+        return "".join(chunks)
 
     def add_text(self, type, text):
-        self._gcode_data += (
-            "G90\nG1 X"
-            + str(round(self._offset[0], 3))
-            + "Y"
-            + str(round(self._offset[1], 3))
-        )
-        self._gcode_data += "F5000S0\nG91\nG1"
-        self._gcode_data += (
-            "X" + self._variant["x_offset"] + "Y" + self._variant[type][0] + "S0\n"
+        chunks = []
+        self._add_text(chunks, self._variant, self._origin, type, text)
+        self._result.extend(chunks)
+
+    def _add_text(
+        self, chunks, variant, origin, type, text, font_size=None, spacing=None
+    ):
+        self.place_text(
+            chunks,
+            origin,
+            variant["x_offset"],
+            variant[type][0],
+            text,
+            font_size or variant[type][1],
+            spacing,
         )
 
-        font_size = self._variant[type][1]
-        offset = self.find_max(font_size)
+    def place_text(
+        self, chunks, origin, x, y, text, font_size, spacing=None,
+        interval=LINE_INTERVAL,
+    ):
+        """Appends the chunks that engrave text with its baseline at (x, y).
+
+        x and y are mm from the card origin, as numbers or as the strings
+        of the variants. Any font size is scaled from the exported ones,
+        and scanned every interval mm.
+        """
+        if not isinstance(x, str):
+            x = format_number(x)
+        if not isinstance(y, str):
+            y = format_number(y)
+        chunks.append(origin)
+        chunks.append("G1 X" + x + "Y" + y + "S0\n")
+
+        if spacing is None:
+            spacing = self.font_metrics(font_size)[1]
         x_offset = 0
         for i in text:
             if i == " ":
-                x_offset = self._fonts[font_size][0]
+                x_offset = self.font_metrics(font_size)[0]
             else:
-                i = "dot" if i == "." else i
-                i = "slash" if i == "/" else i
-                i = "backslash" if i == "\\" else i
-                with open(
-                    self.path + "Letters/" + font_size + "/" + i + ".gc", "r"
-                ) as file:
-                    letter = file.read()
-                self._gcode_data += (
-                    "G0 X" + str(x_offset) + "Y" + str(-offset[i][1]) + "\n" + letter
+                glyph = self._atlas.get_glyph(font_size, i, interval)
+                chunks.append(
+                    "G0 X" + str(x_offset) + "Y" + str(-glyph["y_offset"]) + "\n"
                 )
-                self._gcode_data += (
+                chunks.append(glyph["gcode"])
+                chunks.append(
                     "G0 X"
-                    + str(round(offset[i][0] + self._fonts[font_size][1], 3))
+                    + str(round(glyph["x_max"] + spacing, 3))
                     + "Y"
-                    + str(offset[i][1])
+                    + str(glyph["y_offset"])
                     + "\n"
                 )
                 x_offset = 0
 
-    def find_max(self, font):
-        letters = os.listdir(self.path + "Letters/" + font)
-        letters.sort()
-        offset = {}
-        for letter in letters:
-            x_max, x = 0, 0
-            y_offset, y = 0, 0
-            abs_mode = True
-            power_on = False
-            first_y = True
-            s_value = 0
-            with open(self.path + "Letters/" + font + "/" + letter, "r") as file:
-                gcode = file.read()
-            lines = gcode.strip().split("\n")
-            for line in lines:
-                if line.startswith(";") or not line.strip():
-                    continue
+    def font_metrics(self, font_size):
+        """Returns [space width, letter spacing] of a font size.
+
+        Sizes without hand-tuned values are scaled from the nearest one.
+        """
+        font_size = font_key(font_size)
+        if font_size in self._fonts:
+            return self._fonts[font_size]
+        base = min(self._fonts, key=lambda f: abs(float(f) - float(font_size)))
+        scale = float(font_size) / float(base)
+        return [round(value * scale, 3) for value in self._fonts[base]]
 
-                if line.startswith("G90"):
-                    abs_mode = True
-                elif line.startswith("G91"):
-                    abs_mode = False
-                elif line.startswith("M3") or line.startswith("M4"):
-                    power_on = True
-                elif line.startswith("M5"):
-                    power_on = False
-
-                if line.startswith(("G0", "G00", "G1", "G01")):
-                    matches = re.findall(
-                        r"X([-+]?[0-9]*\.?[0-9]+)|Y([-+]?[0-9]*\.?[0-9]+)|S([0-9]+)",
-                        line,
+    def measure(
+        self, text, font_size, spacing=None, fold_case=True,
+        interval=LINE_INTERVAL,
+    ):
+        """Returns the engraved width of text in mm, as add_text lays it out.
+
+        Every glyph advances by its x_max plus the letter spacing of the
+        font, a run of spaces by the space width of the font. Raises
+        KeyError if a character has no glyph; without fold_case also for
+        lower case letters, which are otherwise engraved as capitals. The
+        glyphs are those scanned every interval mm, see place_text.
+        """
+        if not fold_case:
+            glyphs = self._atlas.get_font(font_size, interval)
+            for char in text:
+                if char != " " and GLYPH_NAMES.get(char, char) not in glyphs:
+                    raise KeyError(char)
+        space, default_spacing = self.font_metrics(font_size)
+        spacing = default_spacing if spacing is None else spacing
+        metrics = self._atlas.get_metrics(font_size, interval)
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        known = codes < len(metrics)
+        known[known] = ~np.isnan(metrics[codes[known]])
+        if not known.all():
+            raise KeyError(text[np.argmin(known)])
+        is_glyph = codes != ord(" ")
+        count = np.count_nonzero(is_glyph)
+        if count == 0:
+            return 0.0
+        # Spaces only move the next glyph, trailing ones are not engraved
+        gaps = np.count_nonzero(is_glyph[1:] & ~is_glyph[:-1])
+        return float(
+            metrics[codes].sum() + spacing * (count - 1) + space * gaps
+        )
+
+    def fit_field(self, variant, type, text, min_spacing=0.5):
+        """Picks the font size and letter spacing for a field of a variant.
+
+        The font of the variant is kept if possible, the letter spacing is
+        narrowed down to min_spacing times its default before falling back
+        to a smaller font. Returns [font_size, spacing], None if the text
+        does not fit in any font. Like add_text, only the text up to a
+        character without a glyph is fitted.
+        """
+        variant = self._variants[variant]
+        available = float(variant["width"]) - float(variant["x_offset"])
+        font_size = variant[type][1]
+        sizes = [font_size] + sorted(
+            (f for f in self._fonts if float(f) < float(font_size)),
+            key=float,
+            reverse=True,
+        )
+        for size in sizes:
+            engraved = text
+            try:
+                width = self.measure(text, size)
+            except KeyError as e:
+                engraved = text[:text.index(e.args[0])]
+                width = self.measure(engraved, size)
+            if width <= available:
+                return [size, self._fonts[size][1]]
+            glyphs = len(engraved.replace(" ", ""))
+            if glyphs < 2:
+                continue
+            tight = self.measure(engraved, size, 0)
+            spacing = round((available - tight) / (glyphs - 1), 3)
+            if spacing >= self._fonts[size][1] * min_spacing:
+                return [size, spacing]
+        return None
+
+    def validate(self, records):
+        """Checks a queue of info dicts before any G-code is generated.
+
+        Returns a list of [record index, field, problem] for every field
+        that overflows the card or contains a character without a glyph.
+        """
+        problems = []
+        for n, info in enumerate(records):
+            variant = self._variants.get(info.get("variant"))
+            if variant is None:
+                problems.append([n, "variant", "unknown variant"])
+                continue
+            available = float(variant["width"]) - float(variant["x_offset"])
+            for i in info:
+                if i == "variant" or info[i] == "":
+                    continue
+                if i not in variant:
+                    problems.append([n, i, "not on this variant"])
+                    continue
+                try:
+                    width = self.measure(info[i], variant[i][1])
+                except KeyError as e:
+                    problems.append([n, i, "no glyph for " + str(e)])
+                    continue
+                if width > available:
+                    problems.append(
+                        [n, i, "%.2f mm wide, %.2f mm available" % (width, available)]
                     )
-                    for match in matches:
-                        if match[0]:
-                            x_new = float(match[0])
-                            x = x_new if abs_mode else x + x_new
-                        if match[1]:
-                            y_new = float(match[1])
-                            if line.startswith(("G0", "G00")) and first_y:
-                                y_offset = y_new
-                                first_y = False
-                            y = y_new if abs_mode else y + y_new
-                        if match[2]:
-                            s_value = int(match[2])
-
-                    if line.startswith(("G0", "G00")):
-                        pass
-                    elif power_on and (s_value is None or s_value > 0):
-                        x_max = x if x > x_max else x_max
-            offset[letter.removesuffix(".gc")] = [round(x_max, 3), round(y_offset, 3)]
-        return offset
-
-    def clean_up(self):
-        self._gcode_data = self._gcode_data.replace("M2\n", "")
-        # self._gcode_data = self._gcode_data.replace('M4\n', '')
-        # self._gcode_data = self._gcode_data.replace('M5\n', '')
-        self._gcode_data = self._gcode_data.replace("M8\n", "")
-        self._gcode_data = self._gcode_data.replace("M9\n", "")
-        self._gcode_data = self._gcode_data.replace("G00 G17 G40 G21 G54\n", "")
-        self._gcode_data = "G00 G17 G40 G21 G54\nM4\n" + self._gcode_data
-        self._gcode_data += "G1 S0\nM5\nM2"
+        return problems
+
+    def find_max(self, font):
+        glyphs = self._atlas.get_font(font)
+        return {
+            letter: [glyph["x_max"], glyph["y_offset"]]
+            for letter, glyph in glyphs.items()
+        }
+
+
+# Generator of a generate_sheet worker process, its glyphs are loaded once
+_worker_generator = None
+
+
+def _init_worker(compact, field_cache_size):
+    global _worker_generator
+    # Workers only render fields, the templates are added by the parent
+    _worker_generator = Generate_Gcode(
+        compact=compact,
+        field_cache_size=field_cache_size,
+        preload_templates=False,
+    )
+
+
+def _render_fields(info, offset, auto_fit):
+    return ["".join(_worker_generator.field_chunks(info, offset, auto_fit))]
 
 
 if __name__ == "__main__":
@@ -241,5 +1089,4 @@ if __name__ == "__main__":
     gcode_data = gcode.get_gcode()
     # prev = GCodePreview(offset=[4, 86])
     # prev.generate_preview(gcode_data).show()
-    # with open("test_Generate.gc", "w") as outfile:
-    #     outfile.write(gcode_data)
+    # gcode.write_gcode("test_Generate.gc")
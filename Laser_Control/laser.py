@@ -1,4 +1,5 @@
 from sys import argv
+import itertools
 import threading
 import serial
 from time import sleep, time
@@ -149,7 +150,12 @@ class Laser:
         threading.Thread(target=self._send_command, args=[command], daemon=True).start()
         return 0
 
-    def _run_code(self, codes: list[str]):
+    def _run_code(self, codes, total_lines=None):
+        """
+        Send codes line by line. codes may be any iterable of lines; for an
+        iterator (e.g. Gcode_Result.lines()) pass total_lines, the number of
+        executable lines, so it is consumed while streaming.
+        """
         if not self.is_connected:
             return
         if self.is_running:
@@ -160,12 +166,14 @@ class Laser:
 
         self.progress = 0
 
-        codes.insert(0, "G90")
-        executable_lines = [
-            code for code in codes
-            if not code.strip().startswith(";") and not code.isspace() and len(code.strip()) > 0
-        ]
-        total_lines = len(executable_lines)
+        if total_lines is None:
+            codes = list(codes)
+            total_lines = len([
+                code for code in codes
+                if not code.strip().startswith(";") and not code.isspace() and len(code.strip()) > 0
+            ])
+        codes = itertools.chain(["G90"], codes)
+        total_lines += 1
         current_line = 0
         print(total_lines)
 
@@ -238,12 +246,14 @@ class Laser:
             return ""
         return codes
 
-    def run_code(self, codes: list[str]):
+    def run_code(self, codes, total_lines=None):
         if not self.is_connected:
             return -1
         if self.is_running:
             return -1
-        threading.Thread(target=self._run_code, args=[codes], daemon=True).start()
+        threading.Thread(
+            target=self._run_code, args=[codes, total_lines], daemon=True
+        ).start()
         return 0
 
     def stop(self):
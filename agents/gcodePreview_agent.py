@@ -187,16 +187,21 @@ def _show_with_tk(img: Image.Image, window_title: str = "G-code Preview") -> Non
 
 
 def _preview_worker(
-    gcode_text: str,
+    gcode_text: Optional[str],
     save_path: str,
     cfg: Dict[str, Any],
     open_viewer: bool,
     window_title: str = "G-code Preview",
+    gcode_path: Optional[str] = None,
 ) -> None:
     """
     Run preview generation in a separate process so LangGraph doesn't block the main loop.
     If `open_viewer` is True, this function will block until the Tk window is closed.
+    Without gcode_text, the G-code is read from gcode_path inside the worker.
     """
+    if gcode_text is None:
+        with open(gcode_path, "r", encoding="utf-8", errors="ignore") as f:
+            gcode_text = f.read()
     preview = GCodePreview(
         card_width=float(cfg.get("card_width", 85.0)),
         card_height=float(cfg.get("card_height", 54.0)),
@@ -235,9 +240,13 @@ def gcode_preview_node(state: Dict[str, Any]) -> Dict[str, Any]:
     LangGraph-compatible node that renders a PNG preview from G-code and
     **waits until the preview window is closed** (when open_gcode_preview=True).
     """
+    # The G-code normally stays on disk; gcode_content is still accepted
     gcode_text = state.get("gcode_content")
+    gcode_path = state.get("gcode_path")
     if not gcode_text or not isinstance(gcode_text, str) or not gcode_text.strip():
-        raise ValueError("Missing or empty 'gcode_content' in state.")
+        if not gcode_path or not os.path.exists(gcode_path):
+            raise ValueError("Missing 'gcode_path' or 'gcode_content' in state.")
+        gcode_text = None
 
     # Build config from state (non-breaking; uses your defaults)
     cfg: Dict[str, Any] = dict(state.get("gcode_preview_config", {}) or {})
@@ -258,7 +267,7 @@ def gcode_preview_node(state: Dict[str, Any]) -> Dict[str, Any]:
     print("[gcode_preview_node] Launching preview in a separate process...")
     proc = multiprocessing.Process(
         target=_preview_worker,
-        args=(gcode_text, save_path, cfg, open_viewer, window_title),
+        args=(gcode_text, save_path, cfg, open_viewer, window_title, gcode_path),
     )
     proc.start()
     # IMPORTANT: This blocks the main process until the preview window is closed
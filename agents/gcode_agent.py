@@ -1,8 +1,350 @@
 # gcode_agent.py
 # Updated generate_gcode.py as LangGraph-compatible node
+import contextlib
+import hashlib
+import math
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 from PIL import Image
 from pathlib import Path
 
+# Runs converted to Python numbers at once while writing G-code
+RUN_CHUNK = 4096
+
+# A G-code word: letter and number
+_WORD = re.compile(r"([A-Z])\s*([-+]?[0-9]*\.?[0-9]+)")
+
+# Steps per mm of the integer grid of compact_emitter: the 3 decimals of G-code
+GRID = 1000
+
+# Text of grid values, filled as compact_emitter writes them up to
+# GRID_TEXT_SIZE entries, values that come later are formatted every time
+GRID_TEXT_SIZE = 1 << 16
+_GRID_TEXT = {}
+
+# Row caches of the jobs gcode_generation_node wrote last, see RowCache
+ROW_CACHE_JOBS = 4
+_ROW_CACHES = {}
+_ROW_CACHES_LOCK = threading.Lock()
+
+
+def load_bitmap(bw_image_path, brightness_threshold=128):
+    """
+    Load an image once as a boolean array of dark pixels.
+    Row 0 is the bottom row of the image, matching the bottom-up motion.
+    """
+    img = np.asarray(Image.open(bw_image_path).convert('L'))
+    return np.flipud(img < brightness_threshold)
+
+
+def power_lut(max_power=400, min_power=0, levels=16, gamma=1.0):
+    """
+    Build a 256 entry table from luminance to laser power (S value).
+
+    Darkness is quantized to `levels` steps, so neighbouring pixels of
+    similar tone share a power and merge into one move. White is always 0;
+    every other step lies between min_power and max_power, shaped by gamma.
+    """
+    darkness = 1.0 - np.arange(256) / 255.0
+    step = np.round(darkness * (levels - 1)) / (levels - 1)
+    power = min_power + (step ** gamma) * (max_power - min_power)
+    return np.where(step > 0, np.rint(power), 0).astype(np.uint16)
+
+
+def load_power_map(image_path, lut):
+    """
+    Load an 8-bit image once and map its luminance through a power LUT.
+    Row 0 is the bottom row of the image, matching the bottom-up motion.
+    """
+    img = np.asarray(Image.open(image_path).convert('L'))
+    return np.flipud(np.asarray(lut)[img])
+
+
+def crop_to_ink(bitmap):
+    """
+    Crop a 2D array to the bounding box of its non-zero pixels.
+
+    Returns the cropped array and the (row, col) of its first pixel in the
+    original array; an empty array for a blank image.
+    """
+    rows = np.flatnonzero(bitmap.any(axis=1))
+    if rows.size == 0:
+        return bitmap[:0, :0], (0, 0)
+    cols = np.flatnonzero(bitmap.any(axis=0))
+    return bitmap[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1], (rows[0], cols[0])
+
+
+def find_runs(power):
+    """
+    Find runs of equal, non-zero values in every row of a 2D array.
+
+    Returns four arrays (rows, starts, ends, values), ordered by row and
+    start column; ends are inclusive.
+    """
+    height, width = power.shape
+    padded = np.zeros((height, width + 2), dtype=power.dtype)
+    padded[:, 1:-1] = power
+    # A boundary at index c lies between columns c-1 and c
+    rows, cols = np.nonzero(padded[:, 1:] != padded[:, :-1])
+    same_row = rows[1:] == rows[:-1]
+    rows, starts, ends = rows[:-1][same_row], cols[:-1][same_row], cols[1:][same_row] - 1
+    values = power[rows, starts]
+    burn = values != 0
+    return rows[burn], starts[burn], ends[burn], values[burn]
+
+
+class MachineTime:
+    """
+    Estimates the run time of G-code lines from the feed, the rapid rate
+    (mm/min) and the acceleration (mm/s^2) of the machine.
+
+    Consecutive moves in the same direction at the same speed form one
+    stretch, which accelerates from and brakes to a standstill. A change
+    of direction or speed ends a stretch, and so does every line without
+    motion (M3/M4/M5, a lone S), because GRBL empties its planner on them.
+    """
+
+    def __init__(self, feedrate, rapid_rate=6000, acceleration=500):
+        self.feed = feedrate / 60.0
+        self.rapid = rapid_rate / 60.0
+        self.acceleration = acceleration
+        self.relative = False
+        self.motion = "0"
+        self.pos = (0.0, 0.0)
+        self.total = 0.0
+        self.stretch = None
+        self.effects = 0  # lines that moved or stopped the head
+
+    def add(self, line):
+        # Words may be written without spaces, like X4.0Y86.0F5000S0
+        words = _WORD.findall(line.partition(";")[0].upper())
+        if not words:
+            return
+        x = y = None
+        for letter, value in words:
+            if letter == "X":
+                x = float(value)
+            elif letter == "Y":
+                y = float(value)
+            elif letter == "G":
+                code = value.lstrip("0") or "0"
+                if code in ("0", "1"):
+                    self.motion = code
+                elif code == "90":
+                    self.relative = False
+                elif code == "91":
+                    self.relative = True
+            elif letter == "F":
+                self.feed = float(value) / 60.0
+        if x is None and y is None:
+            self.effects += 1
+            self._stop()
+            return
+        px, py = self.pos
+        if self.relative:
+            dx, dy = x or 0.0, y or 0.0
+        else:
+            dx = 0.0 if x is None else x - px
+            dy = 0.0 if y is None else y - py
+        self.pos = (px + dx, py + dy)
+        length = math.hypot(dx, dy)
+        if length < 1e-9:
+            return
+        self.effects += 1
+        speed = self.rapid if self.motion == "0" else self.feed
+        stretch = self.stretch
+        if (
+            stretch
+            and stretch[2] == speed
+            and abs(dx * stretch[1] - dy * stretch[0]) < 1e-6 * length
+            and dx * stretch[0] + dy * stretch[1] > 0
+        ):
+            stretch[3] += length
+        else:
+            self._stop()
+            # Open stretch: direction, speed and length
+            self.stretch = [dx / length, dy / length, speed, length]
+
+    def _stop(self):
+        if self.stretch:
+            self.total += self._duration(self.stretch)
+            self.stretch = None
+
+    def _duration(self, stretch):
+        speed, length = stretch[2:]
+        a = self.acceleration
+        if length * a >= speed * speed:
+            # Trapezoid: accelerate, cruise, brake
+            return length / speed + speed / a
+        # Triangle: braking starts before the speed is reached
+        return 2 * (length / a) ** 0.5
+
+    @property
+    def seconds(self):
+        self._stop()
+        return self.total
+
+    def measure(self, lines):
+        """
+        Add lines, return their seconds and displacement for advance(), or
+        None if they neither move nor stop the head.
+        """
+        stretch, total, (px, py) = self.stretch, self.total, self.pos
+        effects = self.effects
+        for line in lines:
+            self.add(line)
+        if self.effects == effects:
+            return None
+        if stretch:
+            # Ended by the lines, its time is not theirs
+            total += self._duration(stretch)
+        self._stop()
+        return self.total - total, self.pos[0] - px, self.pos[1] - py
+
+    def advance(self, measured):
+        """Account for lines measured before, without adding them again."""
+        if measured:
+            seconds, dx, dy = measured
+            self._stop()
+            self.total += seconds
+            self.pos = (self.pos[0] + dx, self.pos[1] + dy)
+
+
+def estimate_machine_time(lines, feedrate, rapid_rate=6000, acceleration=500):
+    """Estimated run time in seconds of G-code lines, see MachineTime."""
+    estimate = MachineTime(feedrate, rapid_rate, acceleration)
+    for line in lines:
+        estimate.add(line)
+    return estimate.seconds
+
+
+def toolpath(lines):
+    """
+    The moves of G-code lines as (x, y, power): the absolute end point of
+    every move in mm and the S it burns with, 0 for rapids and with the
+    laser off. Modal G words, omitted axes and G90/G91 are followed and
+    moves that do not move are left out, so programs that are only written
+    differently give the same toolpath.
+    """
+    relative = False
+    motion = "0"
+    laser = False
+    power = 0.0
+    x = y = 0.0
+    path = []
+    for line in lines:
+        tx = ty = None
+        for letter, value in _WORD.findall(line.partition(";")[0].upper()):
+            if letter == "X":
+                tx = float(value)
+            elif letter == "Y":
+                ty = float(value)
+            elif letter == "S":
+                power = float(value)
+            elif letter in "GM":
+                code = value.lstrip("0") or "0"
+                if letter == "M":
+                    laser = code in ("3", "4") or (laser and code not in ("2", "5"))
+                elif code in ("0", "1"):
+                    motion = code
+                elif code in ("90", "91"):
+                    relative = code == "91"
+        if tx is None and ty is None:
+            continue
+        if relative:
+            nx, ny = x + (tx or 0.0), y + (ty or 0.0)
+        else:
+            nx = x if tx is None else tx
+            ny = y if ty is None else ty
+        if abs(nx - x) < 1e-9 and abs(ny - y) < 1e-9:
+            continue
+        x, y = nx, ny
+        path.append((x, y, power if laser and motion == "1" else 0.0))
+    return path
+
+
+def same_toolpath(lines, other_lines, tolerance=1e-3):
+    """True if two programs make the same moves, see toolpath."""
+    path, other = toolpath(lines), toolpath(other_lines)
+    return len(path) == len(other) and all(
+        abs(x - ox) <= tolerance and abs(y - oy) <= tolerance and p == op
+        for (x, y, p), (ox, oy, op) in zip(path, other)
+    )
+
+
+class GcodeWriter:
+    """
+    Writes G-code lines to an open file as they are produced, separated by
+    newlines like "\n".join(lines), and counts them. With a MachineTime,
+    every line is also passed to its estimate.
+    """
+
+    def __init__(self, file, estimate=None):
+        self.file = file
+        self.estimate = estimate
+        self.lines = 0
+
+    def append(self, line):
+        if self.lines:
+            self.file.write("\n")
+        self.file.write(line)
+        # Parallel bands arrive as one string of several lines
+        self.lines += line.count("\n") + 1
+        if self.estimate:
+            for part in line.split("\n"):
+                self.estimate.add(part)
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def record(self, lines):
+        """
+        Append lines and return them as a block for replay: the joined
+        text, the line count and their measure (see MachineTime.measure).
+        """
+        text = "\n".join(lines)
+        if lines:
+            if self.lines:
+                self.file.write("\n")
+            self.file.write(text)
+            self.lines += len(lines)
+        return text, len(lines), self.estimate.measure(lines) if self.estimate else None
+
+    def replay(self, block):
+        """Append a block of record() again, without estimating its lines."""
+        text, count, measured = block
+        if not count:
+            return
+        if self.lines:
+            self.file.write("\n")
+        self.file.write(text)
+        self.lines += count
+        if self.estimate:
+            self.estimate.advance(measured)
+
+
+class RowCache:
+    """
+    The G-code of the rows of the last version of a job, found again by a
+    hash of their pixels. Given to generate_scanline_gcode as row_cache,
+    only rows that changed since the last call are written anew; a change
+    of settings empties the cache. It holds the G-code of a whole file.
+
+    generate_scanline_gcode holds lock while it uses the cache, so calls
+    on other threads with the same cache take turns.
+    """
+
+    def __init__(self):
+        self.settings = None
+        self.rows = {}
+        self.hits = 0
+        self.lock = threading.Lock()
+
+
 def generate_scanline_gcode(
     bw_image_path,
     gcode_path,
@@ -12,6 +354,17 @@ def generate_scanline_gcode(
     brightness_threshold=128,
     use_relative=False,             # Enable G91-style relative positioning
     anchor=(0.0, 0.0),              # Anchor like Generate_gcode.py
+    engine="run-length",            # "run-length" or the original "per-pixel"
+    grayscale=False,                # Modulate S by luminance instead of thresholding
+    lut=None,                       # 256 S values for grayscale, see power_lut()
+    workers=None,                   # Processes for the run-length engine
+    strategy="toggle",              # "toggle" M3/M5 per run or GRBL "laser-mode"
+    overscan_mm=0.0,                # Lead-in/out with the laser off at row ends
+    unidirectional=False,           # Burn every row from left to right
+    rapid_rate=6000,                # mm/min, for the machine time estimate
+    acceleration=500,               # mm/s^2, for the machine time estimate
+    compact=False,                  # Shortest moves, see compact_emitter
+    row_cache=None,                 # RowCache of the previous version of the job
 ):
     """
     If use_relative is True:
@@ -21,12 +374,175 @@ def generate_scanline_gcode(
 
     If use_relative is False:
       - Same as before: start in absolute (G90) and emit absolute X/Y.
+
+    The "run-length" engine crops the image to its inked bounding box, finds
+    the dark runs of all rows at once with NumPy and emits one G1 per run.
+    Blank rows are skipped with the rapid to the next run, and the zig-zag
+    alternates over inked rows only. "per-pixel" is the original engine: it
+    visits every pixel and emits one G1 per dark pixel. Both burn the same
+    pixels.
+
+    If grayscale is True, bw_image_path may be the 8-bit render: luminance is
+    mapped to S through lut (default: power_lut(laser_power)) and every run of
+    equal power becomes one G1. Touching runs of different power are chained
+    with an S change instead of M5 and a rapid. Only the run-length engine
+    supports grayscale.
+
+    Lines are streamed to gcode_path as they are produced; the return value
+    is a dict with the "path", "lines" and "bytes" of the written file and
+    the estimated machine time in "seconds" (see MachineTime).
+
+    With workers set, the run-length engine splits the runs into horizontal
+    bands and writes their G-code on a process pool. The bands are stitched
+    in order, so the output is identical to the serial one.
+
+    The "toggle" strategy switches the laser with M3 S.. / M5 around every
+    run. These are not motions, so GRBL empties its planner and stops the
+    head at every run. "laser-mode" needs GRBL laser mode ($32=1): it turns
+    on M4 once, puts the power on every burning G1 as S.. and crosses the
+    gaps in a row with G1 .. S0, so the head keeps moving along the row.
+    Only the run-length engine supports it.
+
+    overscan_mm extends every row by a lead-in before its first run and a
+    lead-out after its last one, moved at the feed with the laser off, so
+    the head is up to speed across the ink. With the toggle strategy, M3
+    still stops the head at every run; overscan pays off in laser mode.
+    unidirectional burns every row from left to right and returns with a
+    rapid, which avoids the offset between the two directions of a zig-zag
+    at the cost of time. Both are run-length options.
+
+    compact writes the moves of the run-length engine with compact_emitter:
+    only the axes and words that change, without trailing zeros. The file
+    is smaller and written faster, with the same toolpath (see
+    same_toolpath). Positions are rounded to the 0.001 mm grid first, so
+    relative deltas no longer add up rounding errors when pixel_size_mm is
+    not a whole number of microns.
+
+    With a row_cache, the run-length engine writes the rows serially and
+    takes every row whose pixels, direction (and, where the row's G-code
+    holds its Y, position) did not change from the cache, except for the
+    rapid to its start. The output is identical to that without the cache;
+    the stats add the number of "cached_rows". Calls that share a row_cache
+    take turns.
     """
-    img = Image.open(bw_image_path).convert('L')
-    width, height = img.size
+    if engine == "per-pixel" and (
+        grayscale or strategy != "toggle" or overscan_mm or unidirectional
+        or compact or row_cache is not None
+    ):
+        raise ValueError(
+            "The per-pixel engine only supports binary images and the toggle "
+            "strategy, without overscan, unidirectional rows, compact moves "
+            "or a row cache."
+        )
+    if strategy not in ("toggle", "laser-mode"):
+        raise ValueError(f"Unknown strategy {strategy!r}.")
 
-    gcode = []
-    gcode.append("; Raster engraving from grayscale image")
+    # Ensure output directory exists
+    out_path = Path(gcode_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    estimate = MachineTime(feedrate, rapid_rate, acceleration)
+    lock = row_cache.lock if row_cache is not None else contextlib.nullcontext()
+    with lock:
+        with out_path.open("w", encoding="utf-8") as f:
+            gcode = GcodeWriter(f, estimate)
+            _write_scanline_gcode(
+                gcode, bw_image_path, pixel_size_mm, feedrate, laser_power,
+                brightness_threshold, use_relative, anchor, engine, grayscale,
+                lut, workers, strategy == "laser-mode", overscan_mm,
+                unidirectional, compact, row_cache,
+                (feedrate, rapid_rate, acceleration),
+            )
+        stats = {
+            "path": str(out_path),
+            "lines": gcode.lines,
+            "bytes": out_path.stat().st_size,
+            "seconds": estimate.seconds,
+        }
+        if row_cache is not None:
+            stats["cached_rows"] = row_cache.hits
+
+    print(f"✅ G-code successfully written to '{out_path}'.")
+    return stats
+
+
+def _write_scanline_gcode(
+    gcode, bw_image_path, pixel_size_mm, feedrate, laser_power,
+    brightness_threshold, use_relative, anchor, engine, grayscale, lut, workers,
+    laser_mode, overscan, unidirectional, compact, row_cache=None, machine=(),
+):
+    """The body of generate_scanline_gcode, appending lines to gcode."""
+    last_pos = start_program(
+        gcode, "Raster engraving from grayscale image", feedrate, use_relative, anchor
+    )
+    emit_move, with_anchor = move_emitter(gcode, use_relative, anchor, last_pos)
+
+    if engine == "per-pixel":
+        _per_pixel_moves(
+            bw_image_path, pixel_size_mm, laser_power, brightness_threshold,
+            gcode, emit_move, with_anchor,
+        )
+    else:
+        if grayscale:
+            power = load_power_map(
+                bw_image_path, power_lut(laser_power) if lut is None else lut
+            )
+        else:
+            power = load_bitmap(bw_image_path, brightness_threshold) * laser_power
+        if laser_mode:
+            gcode.append("M4 S0 ; Laser mode, power on G1 moves")
+        runs = _plan_runs(power, not unidirectional)
+        if row_cache is not None:
+            digests = _row_digests(power, runs[0], grayscale)
+        scale = pixel_size_mm
+        if compact:
+            # Grid steps from the anchor (relative) or the origin (absolute)
+            runs = _grid_runs(runs, pixel_size_mm)
+            scale, overscan = 1, round(overscan * GRID)
+            last_pos = [0, 0] if use_relative else [None, None]
+            emit_move, with_anchor = compact_emitter(gcode, use_relative, last_pos)
+        bands = _split_bands(runs[0], workers) if workers else []
+        if row_cache is not None:
+            settings = (
+                pixel_size_mm, laser_power, use_relative, anchor, laser_mode,
+                overscan, compact,
+            ) + tuple(machine)
+            if row_cache.settings != settings:
+                row_cache.settings = settings
+                row_cache.rows = {}
+            row_cache.hits = 0
+
+            def emitter(lines):
+                if compact:
+                    return compact_emitter(lines, use_relative, last_pos)
+                return move_emitter(lines, use_relative, anchor, last_pos)
+
+            _cached_moves(
+                runs, digests, row_cache, scale, gcode, emit_move, with_anchor,
+                last_pos, emitter, laser_mode, overscan, not (use_relative or compact),
+            )
+        elif len(bands) > 1:
+            _parallel_moves(
+                runs, bands, scale, use_relative, anchor, last_pos,
+                gcode, with_anchor, workers, laser_mode, overscan, compact,
+            )
+        else:
+            _run_length_moves(
+                runs, scale, gcode, emit_move, with_anchor, laser_mode,
+                overscan,
+            )
+        if laser_mode:
+            gcode.append("M5")
+
+    end_program(gcode, use_relative)
+
+
+def start_program(gcode, title, feedrate, use_relative, anchor):
+    """
+    Append the program header and return the position it leaves the head
+    at, for the deltas of emit_move in relative mode.
+    """
+    gcode.append(f"; {title}")
     gcode.append("G21 ; Units in mm")
     gcode.append(f"F{feedrate}")
     gcode.append("M5 ; Laser OFF")
@@ -47,25 +563,43 @@ def generate_scanline_gcode(
     else:
         # Original behavior
         gcode.append("G90 ; Absolute positioning")
+    return last_pos
+
+
+def end_program(gcode, use_relative):
+    """Append the return to origin and the program end."""
+    # Return to origin (unchanged)
+    if use_relative:
+        gcode.append("G90 ; Back to absolute for return")
+    gcode.append("G0 X0 Y0 ; Return to origin")
+    gcode.append("M2 ; End of program")
 
-    def emit_move(x_abs, y_abs, rapid=False):
+
+def move_emitter(gcode, use_relative, anchor, last_pos):
+    """
+    Build emit_move and with_anchor for a list of G-code lines.
+    last_pos is updated in place as moves are emitted.
+    """
+
+    def emit_move(x_abs, y_abs, rapid=False, power=None):
         """
         Emit a move to absolute target (x_abs, y_abs), but:
           - in absolute mode: write absolute X/Y
           - in relative mode: write deltas (dx, dy) from last_pos and update last_pos
+        With power set, the move carries it as an S word (laser mode).
         """
-        nonlocal last_pos
         code = "G0" if rapid else "G1"
+        s_word = "" if power is None else f" S{power}"
 
         if use_relative:
             dx = x_abs - last_pos[0]
             dy = y_abs - last_pos[1]
             if abs(dx) > 1e-9 or abs(dy) > 1e-9:
-                gcode.append(f"{code} X{dx:.3f} Y{dy:.3f}")
+                gcode.append(f"{code} X{dx:.3f} Y{dy:.3f}{s_word}")
                 last_pos[0] = x_abs
                 last_pos[1] = y_abs
         else:
-            gcode.append(f"{code} X{x_abs:.3f} Y{y_abs:.3f}")
+            gcode.append(f"{code} X{x_abs:.3f} Y{y_abs:.3f}{s_word}")
             last_pos[0] = x_abs
             last_pos[1] = y_abs
 
@@ -75,6 +609,271 @@ def generate_scanline_gcode(
             return (anchor[0] + x, anchor[1] + y)
         return (x, y)
 
+    return emit_move, with_anchor
+
+
+def _grid_text(value):
+    text = ("%.3f" % (value / GRID)).rstrip("0").rstrip(".")
+    if len(_GRID_TEXT) < GRID_TEXT_SIZE:
+        _GRID_TEXT[value] = text
+    return text
+
+
+def compact_emitter(gcode, use_relative, last_pos):
+    """
+    Counterpart of move_emitter for positions on the integer grid of GRID
+    steps per mm, measured from the anchor in relative mode.
+
+    The text of every value is looked up in a table instead of formatted,
+    trailing zeros are dropped and only the axes that move are written.
+    G0 is written on every rapid; G1 and S only when they change after it.
+    Moves that do not move are skipped. last_pos holds grid steps, None for
+    an unknown position, and is updated in place.
+    """
+    table = _GRID_TEXT
+    written = [None, None]  # G word and S since the last rapid
+
+    def emit_move(x, y, rapid=False, power=None):
+        px, py = last_pos
+        if x == px and y == py:
+            return
+        if rapid:
+            line = "G0 "
+            written[:] = ["0", None]
+        elif written[0] != "1":
+            line = "G1 "
+            written[0] = "1"
+        else:
+            line = ""
+        if x != px:
+            value = x - px if use_relative else x
+            line += "X" + (table.get(value) or _grid_text(value))
+        if y != py:
+            value = y - py if use_relative else y
+            line += "Y" + (table.get(value) or _grid_text(value))
+        if power is not None and power != written[1]:
+            line += f"S{power}"
+            written[1] = power
+        gcode.append(line)
+        last_pos[0] = x
+        last_pos[1] = y
+
+    # Runs are converted to the grid beforehand, see _grid_runs
+    def with_anchor(x, y):
+        return (x, y)
+
+    return emit_move, with_anchor
+
+
+def _plan_runs(power, zigzag=True):
+    """
+    Find the runs of a power map in burn order.
+
+    Returns the arrays (rows, starts, ends, values, reverse, chained, ending,
+    opening, closing): reverse runs are burned from end to start, chained
+    runs continue the burn of the previous run, ending runs are followed by
+    M5, and opening and closing runs are the first and last of their row.
+    """
+    power, (row0, col0) = crop_to_ink(power)
+    rows, starts, ends, values = find_runs(power)
+    # Zig-zag motion: every other inked row is burned from right to left
+    reverse = np.unique(rows, return_inverse=True)[1] % 2 == 1
+    if not zigzag:
+        reverse[:] = False
+    order = np.lexsort((np.where(reverse, -starts, starts), rows))
+    rows, starts, ends = rows[order] + row0, starts[order] + col0, ends[order] + col0
+    values, reverse = values[order], reverse[order]
+    # A run that touches the previous one on the same row continues the burn
+    chained = np.zeros(rows.size, dtype=bool)
+    chained[1:] = (rows[1:] == rows[:-1]) & np.where(
+        reverse[1:], ends[1:] + 1 == starts[:-1], starts[1:] == ends[:-1] + 1
+    )
+    ending = np.ones(rows.size, dtype=bool)
+    ending[:-1] = ~chained[1:]
+    opening = np.ones(rows.size, dtype=bool)
+    opening[1:] = rows[1:] != rows[:-1]
+    closing = np.ones(rows.size, dtype=bool)
+    closing[:-1] = opening[1:]
+    return rows, starts, ends, values, reverse, chained, ending, opening, closing
+
+
+def _grid_runs(runs, pixel_size_mm):
+    """The runs of _plan_runs with rows, starts and ends in GRID steps."""
+    step = pixel_size_mm * GRID
+    rows, starts, ends = (np.rint(run * step).astype(np.int64) for run in runs[:3])
+    return (rows, starts, ends) + tuple(runs[3:])
+
+
+def _row_digests(power, rows, grayscale):
+    """A hash of the pixels of every inked row, in the order of the runs."""
+    rows = np.unique(rows)
+    # Binary rows are hashed packed, eight pixels to a byte
+    pixels = power[rows] if grayscale else np.packbits(power[rows] > 0, axis=1)
+    return [hashlib.blake2b(row.tobytes(), digest_size=16).digest() for row in pixels]
+
+
+def _cached_moves(
+    runs, digests, cache, pixel_size_mm, gcode, emit_move, with_anchor,
+    last_pos, emitter, laser_mode, overscan, keyed_by_y,
+):
+    """
+    _run_length_moves row by row with a RowCache. The G-code of a row after
+    the rapid to its start does not depend on the rows before it, so it is
+    replayed for every row that has the same key as in the last version.
+    emitter(lines) returns emit_move and with_anchor that append to lines
+    and share last_pos.
+    """
+    rows, starts, ends, _, reverse = runs[:5]
+    first = np.flatnonzero(runs[7]).tolist()
+    used = {}
+    for digest, a, b in zip(digests, first, first[1:] + [rows.size]):
+        y = pixel_size_mm * int(rows[a])
+        key = (digest, bool(reverse[a]), y) if keyed_by_y else (digest, bool(reverse[a]))
+        block = cache.rows.get(key)
+        if block is None:
+            lines = []
+            _chunk_moves(
+                [run[a:b].tolist() for run in runs], pixel_size_mm, lines,
+                *emitter(lines), laser_mode, overscan,
+            )
+            # Only the lines after the rapid to the row can be replayed
+            if lines and lines[0].startswith("G0"):
+                gcode.append(lines[0])
+                block = gcode.record(lines[1:])
+            else:
+                gcode.extend(lines)
+        else:
+            cache.hits += 1
+            if reverse[a]:
+                x = pixel_size_mm * int(ends[a]) + overscan
+            else:
+                x = pixel_size_mm * int(starts[a]) - overscan
+            emit_move(*with_anchor(x, y), rapid=True)
+            gcode.replay(block)
+            # The last run of the row closes it, see _chunk_moves
+            last = b - 1
+            if reverse[last]:
+                x = pixel_size_mm * int(starts[last]) - overscan
+            else:
+                x = pixel_size_mm * int(ends[last]) + overscan
+            last_pos[:] = with_anchor(x, y)
+        if block is not None:
+            used[key] = block
+    cache.rows = used
+
+
+def _split_bands(rows, bands):
+    """
+    Split runs into about `bands` slices of similar size that start on a
+    new row, so no chain of runs is cut. Returns (first, stop) indices,
+    none for an image without ink.
+    """
+    if rows.size == 0:
+        return []
+    cuts = np.searchsorted(rows, rows[np.arange(1, bands) * rows.size // bands])
+    edges = np.unique(np.concatenate(([0], cuts, [rows.size])))
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def _parallel_moves(
+    runs, bands, pixel_size_mm, use_relative, anchor, last_pos,
+    gcode, with_anchor, workers, laser_mode, overscan, compact=False,
+):
+    """
+    Write the bands of runs on a process pool and append them in order.
+    Each band starts from the position the previous band ends at, and with
+    a rapid, so compact bands need no other state of the previous band.
+    """
+    rows, starts, ends, _, reverse = runs[:5]
+    jobs = []
+    for first, stop in bands:
+        jobs.append(
+            ([run[first:stop] for run in runs], pixel_size_mm, use_relative,
+             anchor, list(last_pos), laser_mode, overscan, compact)
+        )
+        # The last run of a band closes its row, see _chunk_moves
+        last = stop - 1
+        if reverse[last]:
+            x = pixel_size_mm * int(starts[last]) - overscan
+        else:
+            x = pixel_size_mm * int(ends[last]) + overscan
+        last_pos[:] = with_anchor(x, pixel_size_mm * int(rows[last]))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Each band comes back as one string, joined like the serial lines
+        gcode.extend(pool.map(_band_moves, *zip(*jobs)))
+
+
+def _band_moves(
+    runs, pixel_size_mm, use_relative, anchor, last_pos, laser_mode, overscan,
+    compact,
+):
+    """Worker of _parallel_moves: the G-code of one band, joined."""
+    gcode = []
+    if compact:
+        emit_move, with_anchor = compact_emitter(gcode, use_relative, last_pos)
+    else:
+        emit_move, with_anchor = move_emitter(gcode, use_relative, anchor, last_pos)
+    _run_length_moves(
+        runs, pixel_size_mm, gcode, emit_move, with_anchor, laser_mode, overscan
+    )
+    return "\n".join(gcode)
+
+
+def _run_length_moves(
+    runs, pixel_size_mm, gcode, emit_move, with_anchor, laser_mode, overscan
+):
+    """One G1 per run of equal, non-zero power, see generate_scanline_gcode."""
+    # Converted to Python numbers a chunk at a time to bound memory
+    for first in range(0, runs[0].size, RUN_CHUNK):
+        _chunk_moves(
+            [run[first:first + RUN_CHUNK].tolist() for run in runs],
+            pixel_size_mm, gcode, emit_move, with_anchor, laser_mode, overscan,
+        )
+
+
+def _chunk_moves(
+    runs, pixel_size_mm, gcode, emit_move, with_anchor, laser_mode, overscan
+):
+    # Laser off moves: G1 S0 in laser mode, a plain G1 after M5 otherwise
+    off = 0 if laser_mode else None
+    for row, start, end, value, back, chain, last, first, close in zip(*runs):
+        if back:
+            start, end = end, start
+        lead = -overscan if back else overscan
+        y = pixel_size_mm * row
+        if first and overscan:
+            emit_move(*with_anchor(pixel_size_mm * start - lead, y), rapid=True)
+            emit_move(*with_anchor(pixel_size_mm * start, y), power=off)
+        if laser_mode:
+            # The head keeps moving along a row: gaps are crossed with S0
+            if first and not overscan:
+                emit_move(*with_anchor(pixel_size_mm * start, y), rapid=True)
+            elif not first and not chain:
+                emit_move(*with_anchor(pixel_size_mm * start, y), power=0)
+            emit_move(*with_anchor(pixel_size_mm * end, y), power=value)
+        else:
+            if chain:
+                gcode.append(f"S{value}")
+            else:
+                if not (first and overscan):
+                    emit_move(*with_anchor(pixel_size_mm * start, y), rapid=True)
+                gcode.append(f"M3 S{value}")
+            emit_move(*with_anchor(pixel_size_mm * end, y), rapid=False)
+            if last:
+                gcode.append("M5")
+        if close and overscan:
+            emit_move(*with_anchor(pixel_size_mm * end + lead, y), power=off)
+
+
+def _per_pixel_moves(
+    bw_image_path, pixel_size_mm, laser_power, brightness_threshold,
+    gcode, emit_move, with_anchor,
+):
+    """The original engine: one getpixel() call and one G1 per dark pixel."""
+    img = Image.open(bw_image_path).convert('L')
+    width, height = img.size
+
     for row in range(height):
         y = pixel_size_mm * row
         img_row = height - 1 - row  # Flip Y-axis for correct bottom-up motion
@@ -104,25 +903,28 @@ def generate_scanline_gcode(
             gcode.append("M5")
             laser_on = False
 
-    # Return to origin (unchanged)
-    if use_relative:
-        gcode.append("G90 ; Back to absolute for return")
-    gcode.append("G0 X0 Y0 ; Return to origin")
-    gcode.append("M2 ; End of program")
-
-    # Ensure output directory exists
-    out_path = Path(gcode_path)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-
-    with out_path.open("w", encoding="utf-8") as f:
-        f.write("\n".join(gcode))
 
-    print(f"✅ G-code successfully written to '{out_path}'.")
-    return "\n".join(gcode)
+def job_row_cache(gcode_path):
+    """
+    The RowCache of a job, kept for the ROW_CACHE_JOBS jobs written last.
+    Edited versions of an SVG (name_v002.svg, ...) are the same job.
+    """
+    key = re.sub(r"_v\d{3}$", "", Path(gcode_path).with_suffix("").as_posix())
+    with _ROW_CACHES_LOCK:
+        cache = _ROW_CACHES.pop(key, None) or RowCache()
+        _ROW_CACHES[key] = cache
+        while len(_ROW_CACHES) > ROW_CACHE_JOBS:
+            del _ROW_CACHES[next(iter(_ROW_CACHES))]
+    return cache
 
 
 def gcode_generation_node(state):
     print(f"[gcode_generation_node] state keys: {list(state.keys())}")
+    if state.get("gcode_mode") == "vector":
+        # Imported here, so raster jobs do not need cv2 and svgpathtools
+        from agents.vector_agent import vector_gcode_node
+        return vector_gcode_node(state)
+
     bw_path = state.get("bw_path")
     if not bw_path:
         raise ValueError("Missing 'bw_path' in state from rasterization step.")
@@ -150,8 +952,17 @@ def gcode_generation_node(state):
     else:
         anchor = (0.0, 0.0)
 
-    gcode_text = generate_scanline_gcode(
-        bw_image_path=str(bw_p),
+    # Opt-in: rows of the previous version of the job are reused
+    row_cache = None
+    if state.get("gcode_row_cache", False):
+        row_cache = job_row_cache(gcode_path)
+
+    # Grayscale engraves the 8-bit render instead of the thresholded image
+    grayscale = bool(state.get("gcode_grayscale", False)) and bool(state.get("png_path"))
+    source = state["png_path"] if grayscale else str(bw_p)
+
+    stats = generate_scanline_gcode(
+        bw_image_path=source,
         gcode_path=str(gcode_path),
         pixel_size_mm=0.1,
         feedrate=4000,
@@ -159,9 +970,25 @@ def gcode_generation_node(state):
         brightness_threshold=128,
         use_relative=use_relative,  # Start directly in G91 if True
         anchor=anchor,
+        grayscale=grayscale,
+        lut=state.get("gcode_power_lut"),
+        workers=state.get("gcode_workers"),
+        strategy=state.get("gcode_strategy", "toggle"),
+        overscan_mm=float(state.get("gcode_overscan_mm", 0.0)),
+        unidirectional=bool(state.get("gcode_unidirectional", False)),
+        compact=bool(state.get("gcode_compact", False)),
+        row_cache=row_cache,
     )
+    if row_cache is not None:
+        print(f"[gcode_generation_node] {stats['cached_rows']} rows taken from the row cache")
+    if state.get("glyph_texts"):
+        from agents.text_agent import append_glyph_text
+        offset = anchor if use_relative else (0.0, 0.0)
+        stats = append_glyph_text(gcode_path, state["glyph_texts"], offset, stats)
 
-    state["gcode_content"] = gcode_text
+    # Only the path travels on; the G-code itself stays on disk
+    state.pop("gcode_content", None)
+    state["gcode_stats"] = stats
     state["gcode_path"] = str(gcode_path)
     state["gcode_output_path"] = str(gcode_path)
     return state
@@ -1,12 +1,40 @@
 from PIL import Image
 import cairosvg
-from typing import TypedDict
+import numpy as np
+from typing import TypedDict, List, Dict
+
+from agents.text_agent import split_svg_text
 
 class WorkflowState(TypedDict, total=False):
     svg_content: str
     svg_path: str
     png_path: str
     bw_path: str
+    dither: str                 # Dithering method, see DITHER_METHODS
+    dither_regions: List[Dict]  # [{"box": (x, y, w, h) in SVG mm, "method": ...}]
+    text_as_glyphs: bool        # Engrave <text> with glyphs, see agents/text_agent.py
+    glyph_texts: List[Dict]     # The texts taken out of the raster by split_svg_text
+
+# Error diffusion kernels: (row offset, column offset, weight) and divisor
+DIFFUSION_KERNELS = {
+    "floyd-steinberg": (
+        [(0, 1, 7), (1, -1, 3), (1, 0, 5), (1, 1, 1)],
+        16,
+    ),
+    "atkinson": (
+        # Spreads only 6/8 of the error, which keeps highlights open
+        [(0, 1, 1), (0, 2, 1), (1, -1, 1), (1, 0, 1), (1, 1, 1), (2, 0, 1)],
+        8,
+    ),
+    "jarvis": (
+        [(0, 1, 7), (0, 2, 5),
+         (1, -2, 3), (1, -1, 5), (1, 0, 7), (1, 1, 5), (1, 2, 3),
+         (2, -2, 1), (2, -1, 3), (2, 0, 5), (2, 1, 3), (2, 2, 1)],
+        48,
+    ),
+}
+
+DITHER_METHODS = ("threshold", "bayer") + tuple(DIFFUSION_KERNELS)
 
 def svg_to_png(svg_path, png_path, dpi=254):
     with open(svg_path, 'rb') as svg_file:
@@ -26,13 +54,113 @@ def binarize_image(png_path, bw_path, threshold=180):
     bw.save(bw_path)
     print(f"Binarized '{png_path}' to '{bw_path}' with threshold {threshold}.")
 
+def bayer_matrix(order=3):
+    """Ordered dithering thresholds in [0, 1) of a 2**order square."""
+    matrix = np.zeros((1, 1))
+    for _ in range(order):
+        matrix = np.block([
+            [4 * matrix, 4 * matrix + 2],
+            [4 * matrix + 3, 4 * matrix + 1],
+        ])
+    return (matrix + 0.5) / matrix.size
+
+
+def error_diffusion(gray, kernel, divisor, threshold=128):
+    """
+    Error diffusion of a 2D array of luminance, returns 0/255 as uint8.
+
+    The pixels are processed along wavefronts col + k * row: k is chosen so
+    that every pixel only receives error from earlier wavefronts, and the
+    whole wavefront is handled at once. In the flattened, padded image a
+    wavefront is a strided slice, so each step is a few NumPy slice ops.
+    """
+    height, width = gray.shape
+    # Margins so that no target of the kernel falls outside the array
+    left = max(0, -min(dc for _, dc, _ in kernel))
+    right = max(0, max(dc for _, dc, _ in kernel))
+    bottom = max(dr for dr, _, _ in kernel)
+    k = 1 + max(-dc // dr for dr, dc, _ in kernel if dr > 0)
+    padded_width = left + width + right
+    img = np.zeros((height + bottom, padded_width), dtype=np.float32)
+    img[:height, left:left + width] = gray
+    flat = img.reshape(-1)
+    out = np.zeros(flat.size, dtype=bool)
+    step = padded_width - k
+    weights = [(dr * padded_width + dc, weight / divisor) for dr, dc, weight in kernel]
+
+    for t in range(width + k * (height - 1)):
+        first = max(0, -(-(t - width + 1) // k))
+        last = min(height - 1, t // k)
+        start = first * padded_width + left + t - k * first
+        wave = slice(start, start + (last - first) * step + 1, step)
+        old = flat[wave]
+        white = old > threshold
+        out[wave] = white
+        error = old - np.where(white, 255.0, 0.0)
+        for offset, weight in weights:
+            flat[start + offset:wave.stop + offset:step] += error * weight
+
+    out = out.reshape(img.shape)[:height, left:left + width]
+    return np.where(out, 255, 0).astype(np.uint8)
+
+
+def dither_array(gray, method="floyd-steinberg", threshold=128):
+    """Dither a 2D array of luminance with one of DITHER_METHODS, 0/255 uint8."""
+    gray = np.asarray(gray, dtype=np.float32)
+    if method == "threshold":
+        white = gray > threshold
+    elif method == "bayer":
+        matrix = bayer_matrix()
+        tiles = (-(-gray.shape[0] // matrix.shape[0]), -(-gray.shape[1] // matrix.shape[1]))
+        white = gray > 255 * np.tile(matrix, tiles)[:gray.shape[0], :gray.shape[1]]
+    elif method in DIFFUSION_KERNELS:
+        return error_diffusion(gray, *DIFFUSION_KERNELS[method], threshold=threshold)
+    else:
+        raise ValueError(f"Unknown dither method {method!r}, use one of {DITHER_METHODS}.")
+    return np.where(white, 255, 0).astype(np.uint8)
+
+
+def dither_image(png_path, bw_path, method="floyd-steinberg", regions=None, dpi=254):
+    """
+    Dither a rendered card into a 1-bit image.
+
+    regions optionally selects another method per layout region: a list of
+    {"box": (x, y, width, height), "method": ...} in SVG millimetres (top
+    left origin), applied in order on top of the method for the whole card.
+    Every region is dithered on its own, so its error does not leak out.
+    """
+    gray = np.asarray(Image.open(png_path).convert("L"))
+    bw = dither_array(gray, method)
+    for region in regions or []:
+        x, y, width, height = (round(v * dpi / 25.4) for v in region["box"])
+        # Clipped to the card, a negative end would count from the far edge
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = max(0, x + width), max(0, y + height)
+        box = (slice(y0, y1), slice(x0, x1))
+        if gray[box].size:
+            bw[box] = dither_array(gray[box], region.get("method", method))
+    Image.fromarray(bw).convert("1").save(bw_path)
+    print(f"Dithered '{png_path}' to '{bw_path}' with {method}.")
+
+
 def rasterization_node(state: WorkflowState) -> WorkflowState:
     svg_path = state["svg_path"]
     png_path = svg_path.replace(".svg", ".png")
     bw_path = svg_path.replace(".svg", "_bw.png")
 
-    svg_to_png(svg_path, png_path, dpi=254)
-    binarize_image(png_path, bw_path, threshold=128)
+    # Glyph text is left out of the raster and appended by gcode_generation_node
+    if state.get("text_as_glyphs"):
+        raster_svg_path = svg_path.replace(".svg", "_raster.svg")
+        state["glyph_texts"] = split_svg_text(svg_path, raster_svg_path)
+        svg_to_png(raster_svg_path, png_path, dpi=254)
+    else:
+        state.pop("glyph_texts", None)
+        svg_to_png(svg_path, png_path, dpi=254)
+    method = state.get("dither", "threshold")
+    if method == "threshold" and not state.get("dither_regions"):
+        binarize_image(png_path, bw_path, threshold=128)
+    else:
+        dither_image(png_path, bw_path, method, state.get("dither_regions"), dpi=254)
 
     state["png_path"] = png_path
     state["bw_path"] = bw_path
@@ -0,0 +1,125 @@
+# text_agent.py
+# Compiles the <text> of SVG layouts to Generate_Gcode glyphs instead of raster rows
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from Generate_Gcode.Generate_Gcode import Generate_Gcode
+from agents.gcode_agent import estimate_machine_time
+
+SVG_NS = "http://www.w3.org/2000/svg"
+CARD_HEIGHT_MM = 54.0  # used for flipping Y-axis, as in svg_agent.py
+
+# Baseline below the y of a <text>, in em, per dominant-baseline (Arial metrics)
+BASELINE_SHIFT = {
+    "text-before-edge": 0.905,
+    "hanging": 0.716,
+    "central": 0.358,
+    "middle": 0.358,
+}
+
+_generator = None
+
+
+def get_generator():
+    """One Generate_Gcode per process, its glyph caches are shared by all jobs."""
+    global _generator
+    if _generator is None:
+        # Only glyphs are engraved here, the card templates are not needed
+        _generator = Generate_Gcode(preload_templates=False)
+    return _generator
+
+
+def _first_number(value, default=0.0):
+    match = re.search(r"[-+]?[0-9]*\.?[0-9]+", value or "")
+    return float(match.group()) if match else default
+
+
+def _transformed(element, parents):
+    # svg_editor_agent moves and scales elements through their <g>
+    while element is not None:
+        if element.get("transform"):
+            return True
+        element = parents.get(element)
+    return False
+
+
+def split_svg_text(svg_path, raster_svg_path, fold_case=False):
+    """
+    Take the <text> elements that the glyph library can engrave out of an SVG.
+
+    Returns the texts for Generate_Gcode.render_text (baseline "x" and "y" in
+    mm from the card's bottom-left corner, "text", "font_size") and writes
+    the rest of the SVG, for rasterization, to raster_svg_path. Text with a
+    transform on itself or an enclosing group, or a character without a
+    glyph, stays in the raster SVG. The fonts only have capitals, so lower
+    case letters count as without a glyph unless fold_case is set.
+    """
+    ET.register_namespace("", SVG_NS)
+    tree = ET.parse(svg_path)
+    root = tree.getroot()
+    generator = get_generator()
+
+    texts = []
+    parents = {child: parent for parent in root.iter() for child in parent}
+    for element in list(root.iter(f"{{{SVG_NS}}}text")):
+        text = " ".join("".join(element.itertext()).split())
+        if _transformed(element, parents):
+            continue
+        font_size = "%g" % _first_number(element.get("font-size"), 10.0)
+        try:
+            width = generator.measure(text, font_size, fold_case=fold_case)
+        except KeyError as e:
+            print(f"[split_svg_text] No glyph for {e}, '{text}' stays raster.")
+            continue
+
+        x = _first_number(element.get("x"))
+        anchor = element.get("text-anchor", "start")
+        if anchor == "middle":
+            x -= width / 2
+        elif anchor == "end":
+            x -= width
+        shift = BASELINE_SHIFT.get(element.get("dominant-baseline"), 0.0)
+        y = CARD_HEIGHT_MM - (_first_number(element.get("y")) + shift * float(font_size))
+
+        if text:
+            texts.append(
+                {"x": round(x, 3), "y": round(y, 3), "text": text, "font_size": font_size}
+            )
+        parents[element].remove(element)
+
+    tree.write(raster_svg_path, encoding="utf-8", xml_declaration=False)
+    print(f"[split_svg_text] {len(texts)} text elements as glyphs, rest in '{raster_svg_path}'.")
+    return texts
+
+
+def append_glyph_text(gcode_path, texts, offset=(4.0, 86.0), stats=None):
+    """
+    Append the glyph program of texts to a program written by
+    generate_scanline_gcode (or generate_vector_gcode).
+
+    The raster program returns to the origin; its final M2 is dropped and
+    the glyph program homes and moves to the card offset by itself. stats,
+    as returned for gcode_path, are updated and returned.
+    """
+    result = get_generator().render_text(texts, offset)
+    path = Path(gcode_path)
+    stats = dict(stats or {"path": str(path), "lines": 0, "seconds": 0.0})
+    with path.open("r+b") as f:
+        size = f.seek(0, 2)
+        f.seek(max(0, size - 64))
+        last = f.read().rsplit(b"\n", 1)[-1]
+        if last.startswith(b"M2"):
+            f.seek(size - len(last))
+            f.truncate()
+            stats["lines"] -= 1
+        elif size:
+            f.write(b"\n")
+        f.write(result.get_gcode().encode("utf-8"))
+
+    lines = list(result.lines())
+    stats["lines"] += len(lines)
+    stats["bytes"] = path.stat().st_size
+    stats["seconds"] += estimate_machine_time(lines, 5000)
+    print(f"[append_glyph_text] Engraved {len(texts)} texts with glyphs in '{path}'.")
+    return stats
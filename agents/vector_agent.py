@@ -0,0 +1,266 @@
+# vector_agent.py
+# Vector engraving: contours and hatch fills as G1 moves instead of raster rows
+import xml.etree.ElementTree as ET
+from itertools import chain
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+from svgpathtools import Document, Line
+
+from agents.gcode_agent import (
+    GcodeWriter,
+    MachineTime,
+    end_program,
+    move_emitter,
+    start_program,
+)
+
+SVG_NS = "http://www.w3.org/2000/svg"
+
+
+def trace_bitmap(bw_image_path, pixel_size_mm=0.1, brightness_threshold=128):
+    """
+    Trace the outlines of the dark areas of an image with cv2.findContours.
+
+    Returns closed polygons (the last point repeats the first) as (N, 2)
+    arrays in mm, in the coordinates of generate_scanline_gcode: pixel
+    centres, row 0 at the bottom. Holes are returned as polygons of their
+    own, so hatch_segments fills even-odd.
+    """
+    img = np.asarray(Image.open(bw_image_path).convert('L'))
+    dark = np.where(img < brightness_threshold, 255, 0).astype(np.uint8)
+    contours, _ = cv2.findContours(dark, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    height = img.shape[0]
+    polygons = []
+    for contour in contours:
+        points = contour.reshape(-1, 2).astype(float)
+        points = np.vstack((points, points[:1]))
+        # Flip Y-axis for correct bottom-up motion
+        points[:, 1] = height - 1 - points[:, 1]
+        polygons.append(points * pixel_size_mm)
+    return polygons
+
+
+def svg_outlines(svg_path, tolerance=0.05):
+    """
+    Flatten the paths and shapes of an SVG into polylines in mm.
+
+    Returns (outlines, fills): every subpath as an (N, 2) array, and the
+    closed subpaths of filled elements for hatching. Curves are sampled so
+    that no chord is longer than tolerance. The transforms of the elements
+    and their groups are applied and the Y-axis is flipped to the card's
+    bottom-left origin. <text> and <image> elements are not converted, see
+    unconverted_elements.
+    """
+    root = ET.parse(svg_path).getroot()
+    view_box = root.get("viewBox")
+    height = float(view_box.split()[3]) if view_box else float(
+        root.get("height", "54").replace("mm", "")
+    )
+    # Unlike svg2paths, Document applies the transforms of groups as well
+    paths = Document(svg_path).paths()
+
+    outlines, fills = [], []
+    for path in paths:
+        filled = path.element.get("fill", "black") != "none"
+        for subpath in path.continuous_subpaths():
+            points = [subpath.start]
+            for segment in subpath:
+                if isinstance(segment, Line):
+                    points.append(segment.end)
+                    continue
+                steps = max(2, int(np.ceil(segment.length() / tolerance)))
+                for t in np.linspace(0, 1, steps + 1)[1:]:
+                    points.append(segment.point(t))
+            points = np.array([(p.real, height - p.imag) for p in points])
+            outlines.append(points)
+            if filled and subpath.isclosed():
+                fills.append(points)
+    return outlines, fills
+
+
+def unconverted_elements(svg_path):
+    """Count the <text> and <image> elements of an SVG, which svg_outlines skips."""
+    root = ET.parse(svg_path).getroot()
+    counts = {}
+    for tag in ("text", "image"):
+        count = sum(1 for _ in root.iter(f"{{{SVG_NS}}}{tag}"))
+        if count:
+            counts[tag] = count
+    return counts
+
+
+def hatch_segments(polygons, spacing=0.1):
+    """
+    Hatch the inside of closed polygons with horizontal lines, even-odd.
+
+    Returns (starts, ends) as (N, 2) arrays in burn order: line by line from
+    the bottom, zig-zagging, so every segment starts near the last one.
+    """
+    polygons = [np.asarray(p, dtype=float) for p in polygons if len(p) > 2]
+    if not polygons:
+        return np.zeros((0, 2)), np.zeros((0, 2))
+    edges = np.concatenate([
+        np.hstack((p, np.roll(p, -1, axis=0))) for p in polygons
+    ])
+    x0, y0, x1, y1 = edges.T
+    low, high = np.minimum(y0, y1), np.maximum(y0, y1)
+    base = low.min() + spacing / 2
+
+    # Every edge crosses the hatch lines base + i * spacing with low <= y < high
+    first = np.ceil((low - base) / spacing).astype(int)
+    count = np.maximum(np.ceil((high - base) / spacing).astype(int) - first, 0)
+    edge = np.repeat(np.arange(edges.shape[0]), count)
+    line = np.repeat(first - np.cumsum(count) + count, count) + np.arange(count.sum())
+    y = base + line * spacing
+    x = x0[edge] + (y - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+
+    # Pairs of crossings along a line bound the inside
+    order = np.lexsort((x, line))
+    line, x, y = line[order], x[order], y[order]
+    line, y = line[0::2], y[0::2]
+    left, right = x[0::2], x[1::2]
+
+    # Zig-zag motion: every other hatch line is burned from right to left
+    reverse = np.unique(line, return_inverse=True)[1] % 2 == 1
+    order = np.lexsort((np.where(reverse, -left, left), line))
+    left, right, y, reverse = left[order], right[order], y[order], reverse[order]
+    starts = np.column_stack((np.where(reverse, right, left), y))
+    ends = np.column_stack((np.where(reverse, left, right), y))
+    return starts, ends
+
+
+def generate_vector_gcode(
+    outlines,
+    gcode_path,
+    fills=(),
+    hatch_spacing=0.1,
+    feedrate=4000,
+    laser_power=400,
+    use_relative=False,             # Enable G91-style relative positioning
+    anchor=(0.0, 0.0),              # Anchor like Generate_gcode.py
+    strategy="toggle",              # "toggle" M3/M5 per stroke or GRBL "laser-mode"
+    rapid_rate=6000,                # mm/min, for the machine time estimate
+    acceleration=500,               # mm/s^2, for the machine time estimate
+):
+    """
+    Engrave polylines (in mm) as strokes, after hatching the closed polygons
+    in fills with lines hatch_spacing apart.
+
+    The header, relative mode, strategies and the returned stats are those of
+    generate_scanline_gcode: a dict with "path", "lines", "bytes" and the
+    estimated machine time in "seconds".
+    """
+    if strategy not in ("toggle", "laser-mode"):
+        raise ValueError(f"Unknown strategy {strategy!r}.")
+    laser_mode = strategy == "laser-mode"
+
+    out_path = Path(gcode_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    estimate = MachineTime(feedrate, rapid_rate, acceleration)
+    with out_path.open("w", encoding="utf-8") as f:
+        gcode = GcodeWriter(f, estimate)
+        last_pos = start_program(
+            gcode, "Vector engraving from contours", feedrate, use_relative, anchor
+        )
+        emit_move, with_anchor = move_emitter(gcode, use_relative, anchor, last_pos)
+        if laser_mode:
+            gcode.append("M4 S0 ; Laser mode, power on G1 moves")
+
+        starts, ends = hatch_segments(fills, hatch_spacing)
+        strokes = zip(starts.tolist(), ends.tolist())
+        for points in chain(strokes, (p.tolist() for p in outlines if len(p) > 1)):
+            emit_move(*with_anchor(*points[0]), rapid=True)
+            if laser_mode:
+                for x, y in points[1:]:
+                    emit_move(*with_anchor(x, y), power=laser_power)
+            else:
+                gcode.append(f"M3 S{laser_power}")
+                for x, y in points[1:]:
+                    emit_move(*with_anchor(x, y))
+                gcode.append("M5")
+
+        if laser_mode:
+            gcode.append("M5")
+        end_program(gcode, use_relative)
+
+    print(f"✅ G-code successfully written to '{out_path}'.")
+    return {
+        "path": str(out_path),
+        "lines": gcode.lines,
+        "bytes": out_path.stat().st_size,
+        "seconds": estimate.seconds,
+    }
+
+
+def vector_gcode_node(state):
+    """
+    Vector counterpart of gcode_generation_node, used for gcode_mode "vector".
+
+    vector_source "bitmap" (default) traces the contours of bw_path; "svg"
+    converts the paths of svg_path, and warns about the <text> and <image>
+    elements it cannot engrave. gcode_hatch_spacing (mm) fills the
+    traced shapes, or the filled SVG shapes; without it only the outlines
+    are engraved, which is what thin text needs.
+    """
+    bw_path = state.get("bw_path")
+    source = state.get("vector_source", "bitmap")
+    spacing = state.get("gcode_hatch_spacing")
+
+    if source == "svg":
+        svg_path = state.get("svg_path")
+        if not svg_path:
+            raise ValueError("Missing 'svg_path' in state for vector_source 'svg'.")
+        outlines, fills = svg_outlines(svg_path)
+        gcode_path = Path(svg_path).with_suffix(".gcode")
+        # Glyph text is in glyph_texts, the rest of the text in the raster SVG
+        raster_svg_path = svg_path.replace(".svg", "_raster.svg")
+        left = unconverted_elements(
+            raster_svg_path if state.get("text_as_glyphs") else svg_path
+        )
+        if left:
+            print(
+                "⚠️ [vector_gcode_node] Not engraved with vector_source 'svg': "
+                + ", ".join(f"{count} <{tag}>" for tag, count in left.items())
+                + ". Use the raster gcode_mode for them."
+            )
+    else:
+        if not bw_path:
+            raise ValueError("Missing 'bw_path' in state from rasterization step.")
+        outlines = trace_bitmap(bw_path)
+        fills = outlines
+        name = Path(bw_path).name
+        gcode_path = Path(bw_path).with_name(
+            name.replace("_bw.png", ".gcode") if name.endswith("_bw.png")
+            else Path(bw_path).stem + ".gcode"
+        )
+
+    anchor = state.get("gcode_anchor", (0.0, 0.0))
+    if isinstance(anchor, (list, tuple)) and len(anchor) == 2:
+        anchor = (float(anchor[0]), float(anchor[1]))
+    else:
+        anchor = (0.0, 0.0)
+
+    print(f"[vector_gcode_node] Output gcode_path: {gcode_path}")
+    stats = generate_vector_gcode(
+        outlines,
+        str(gcode_path),
+        fills=fills if spacing else (),
+        hatch_spacing=float(spacing or 0.1),
+        use_relative=bool(state.get("gcode_relative", False)),
+        anchor=anchor,
+        strategy=state.get("gcode_strategy", "toggle"),
+    )
+    if state.get("glyph_texts"):
+        from agents.text_agent import append_glyph_text
+        offset = anchor if state.get("gcode_relative", False) else (0.0, 0.0)
+        stats = append_glyph_text(gcode_path, state["glyph_texts"], offset, stats)
+
+    state.pop("gcode_content", None)
+    state["gcode_stats"] = stats
+    state["gcode_path"] = str(gcode_path)
+    state["gcode_output_path"] = str(gcode_path)
+    return state
@@ -0,0 +1,220 @@
+# card_benchmark.py
+# Benchmark of the template based card generation in Generate_Gcode.
+#
+#   python benchmarks/card_benchmark.py                 # print results
+#   python benchmarks/card_benchmark.py --save          # store as baseline
+#   python benchmarks/card_benchmark.py --compare       # fail on regressions
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Generate_Gcode.Generate_Gcode import (
+    GLYPH_NAMES,
+    Generate_Gcode,
+    Glyph_Atlas,
+    clean_gcode,
+    compact_gcode,
+)
+
+BASELINE = Path(__file__).parent / "baselines" / "card_generation.json"
+
+# Realistic field lengths, with the umlauts and quotes of the 2.5 font
+FIELDS = {
+    "title": "Prof. Dr.-Ing.",
+    "name": "JÖRG MÜLLER-LÜDENSCHEIDT",
+    "division": "Fachbereich Technik – Abteilung Elektrotechnik",
+    "job_title": "Wissenschaftlicher Mitarbeiter „Labor für Lasertechnik“",
+    "phone": "Tel. +49 (0) 491 92817-1234",
+    "fax": "Fax +49 (0) 491 92817-1000",
+    "mail": "joerg.mueller-luedenscheidt@hs-emden-leer.de",
+}
+
+# Counts open() calls while enabled, audit hooks can not be removed again
+_opens = {"enabled": False, "count": 0}
+
+
+def _audit(event, args):
+    if event == "open" and _opens["enabled"]:
+        _opens["count"] += 1
+
+
+sys.addaudithook(_audit)
+
+
+def measure(func, repeat):
+    """Runs func repeat times, returns median seconds, peak bytes, opens."""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+    tracemalloc.start()
+    _opens["count"] = 0
+    _opens["enabled"] = True
+    func()
+    _opens["enabled"] = False
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "seconds": statistics.median(times),
+        "peak_bytes": peak,
+        "file_opens": _opens["count"],
+    }
+
+
+def glyph_text(generate, font):
+    """Every character of a font, as add_text would look it up."""
+    names = {name: char for char, name in GLYPH_NAMES.items()}
+    chars = [names.get(name, name) for name in generate._atlas.get_font(font)]
+    return "".join(sorted(char for char in chars if len(char) == 1))
+
+
+def card_cases(generate):
+    cases = {}
+    for variant, layout in generate._variants.items():
+        info = {"variant": variant}
+        for field in FIELDS:
+            if field in layout:
+                info[field] = FIELDS[field]
+        cases[variant] = info
+    # All glyphs of both fonts, "name" is engraved in 4, "mail" in 2.5
+    cases["unicode"] = {
+        "variant": "blank",
+        "name": glyph_text(generate, "4"),
+        "mail": glyph_text(generate, "2.5"),
+    }
+    return cases
+
+
+def run(repeat):
+    results = {}
+
+    start = perf_counter()
+    generate = Generate_Gcode()
+    results["startup"] = {"seconds": perf_counter() - start}
+
+    # Renders every field of every card, the glyphs are loaded already
+    uncached = Generate_Gcode(field_cache_size=0)
+
+    for name, info in card_cases(generate).items():
+
+        def card(generate=generate, info=info):
+            generate.generate_gcode(info)
+            return generate.get_gcode()
+
+        # Repeated cards only stitch the chunks of the field cache
+        result = measure(card, repeat)
+        result["render_seconds"] = measure(
+            lambda: card(uncached), repeat
+        )["seconds"]
+        gcode = card()
+        result["lines"] = gcode.count("\n") + 1
+        result["bytes"] = len(gcode.encode())
+        results["card/" + name] = result
+
+    # A fresh atlas reads and measures the glyph files, with the index
+    # only those that changed
+    with tempfile.TemporaryDirectory() as tmp:
+        index_path = os.path.join(tmp, "glyph_index.json")
+        for font in ("2.5", "4"):
+
+            def load(font=font, indexed=True):
+                if not indexed and os.path.exists(index_path):
+                    os.remove(index_path)
+                atlas = Glyph_Atlas(generate._atlas.path, index_path=index_path)
+                return atlas.get_font(font)
+
+            load()
+            results["glyphs/%s/indexed" % font] = measure(load, repeat)
+            results["glyphs/%s/unindexed" % font] = measure(
+                lambda load=load: load(indexed=False), repeat
+            )
+
+    for field in ("name", "mail"):
+
+        def add_text(field=field):
+            generate.generate_gcode({"variant": "hs"})
+            generate.add_text(field, FIELDS[field])
+
+        results["add_text/" + field] = measure(add_text, repeat)
+
+    templates = [
+        generate._templates.path + variant + ".gc" for variant in generate._variants
+    ]
+    sources = []
+    for path in templates:
+        with open(path, "r") as file:
+            sources.append(file.read())
+    results["clean_up/templates"] = measure(
+        lambda: [compact_gcode(clean_gcode(gcode)) for gcode in sources], 1
+    )
+    return results
+
+
+def compare(results, baseline, tolerance, slack=0.001):
+    """Returns a line for every metric that got worse than the baseline.
+
+    Timings and peak memory may grow by tolerance (timings also by slack
+    seconds, below which they are noise), counts and sizes not at all.
+    """
+    regressions = []
+    for case, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(case, {}).get(metric)
+            if old is None:
+                continue
+            limit = old
+            if "seconds" in metric:
+                limit = max(old * (1 + tolerance), old + slack)
+            elif metric == "peak_bytes":
+                limit = old * (1 + tolerance)
+            if value > limit:
+                regressions.append(
+                    "%s %s: %.6g -> %.6g" % (case, metric, old, value)
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark card generation")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="store as baseline")
+    parser.add_argument("--compare", action="store_true", help="check baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    for case, metrics in results.items():
+        print(
+            case.ljust(24),
+            "  ".join("%s=%.6g" % (key, value) for key, value in metrics.items()),
+        )
+
+    if args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print("Baseline written to", args.baseline)
+    if args.compare:
+        if not args.baseline.exists():
+            print("No baseline at", args.baseline, "- run with --save first")
+            return 1
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
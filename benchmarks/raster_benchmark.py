@@ -0,0 +1,267 @@
+# raster_benchmark.py
+# Benchmark of the raster engines of generate_scanline_gcode.
+#
+#   python benchmarks/raster_benchmark.py                 # print results
+#   python benchmarks/raster_benchmark.py --save          # store as baseline
+#   python benchmarks/raster_benchmark.py --compare       # fail on regressions
+#   python benchmarks/raster_benchmark.py --dpi 254       # one resolution only
+#
+# Correctness checks run first, a failing one makes the run fail.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.gcode_agent import RowCache, generate_scanline_gcode, same_toolpath
+
+BASELINE = Path(__file__).parent / "baselines" / "raster_generation.json"
+SAMPLES = Path(__file__).parent.parent / "samples"
+
+# Card size in mm, the images are scaled to it at every resolution
+CARD_MM = (85.0, 54.0)
+
+# Keyword arguments of generate_scanline_gcode per strategy
+STRATEGIES = {
+    "per-pixel": {"engine": "per-pixel"},
+    "run-length": {},
+    "laser-mode": {"strategy": "laser-mode"},
+    "overscan": {"strategy": "laser-mode", "overscan_mm": 2.0},
+    "compact": {"compact": True},
+}
+
+
+def synthetic(name, width, height):
+    """A card sized test image of the given ink density, the same every run."""
+    rng = np.random.default_rng(0)
+    img = np.full((height, width), 255, dtype=np.uint8)
+    if name == "text":
+        # Lines of short strokes on a quarter of the card, like a layout
+        line = max(1, height // 40)
+        for top in range(height // 8, height // 2, 3 * line):
+            for left in range(width // 10, width // 2, 2 * line):
+                if rng.random() < 0.7:
+                    img[top:top + 2 * line, left:left + line] = 0
+    elif name == "dense":
+        # Blocks of ink over half of the card
+        block = max(2, width // 60)
+        mask = rng.random((height // block + 1, width // block + 1)) < 0.5
+        img[np.kron(mask, np.ones((block, block), dtype=bool))[:height, :width]] = 0
+    elif name == "halftone":
+        # Every other pixel, the worst case of one run per dark pixel, on a
+        # sixteenth of the card to keep the per-pixel engine bearable
+        patch = img[height // 4:height // 2, width // 4:width // 2]
+        patch[(np.indices(patch.shape).sum(axis=0) % 2) == 0] = 0
+    else:
+        raise ValueError(f"Unknown synthetic image {name!r}.")
+    return Image.fromarray(img)
+
+
+def images(dpi):
+    """(name, image) of the synthetic and sample images at dpi."""
+    width = round(CARD_MM[0] / 25.4 * dpi)
+    height = round(CARD_MM[1] / 25.4 * dpi)
+    for name in ("text", "dense", "halftone"):
+        yield name, synthetic(name, width, height)
+    for path in sorted(SAMPLES.glob("business_card*.png")):
+        img = Image.open(path).convert("L")
+        # Keep the aspect of the photo, scaled to the width of the card
+        size = (width, round(width * img.height / img.width))
+        yield path.stem, img.resize(size, Image.LANCZOS)
+
+
+def _generate(*args, **kwargs):
+    # Without the progress print of every call
+    with contextlib.redirect_stdout(io.StringIO()):
+        return generate_scanline_gcode(*args, **kwargs)
+
+
+def check():
+    """Runs the correctness checks, returns a line for every failure."""
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # A lone pixel at the anchor: its row writes no line in relative
+        # laser mode, the rapid and the burn both have no length
+        img = np.full((20, 30), 255, dtype=np.uint8)
+        img[-1, 0] = 0
+        img[5, 3:9] = 0
+        image_path = os.path.join(tmp, "lone.png")
+        Image.fromarray(img).save(image_path)
+        for strategy in ("toggle", "laser-mode"):
+            for compact in (False, True):
+                kwargs = dict(
+                    use_relative=True, strategy=strategy, compact=compact
+                )
+                plain = os.path.join(tmp, "plain.gcode")
+                cached = os.path.join(tmp, "cached.gcode")
+                try:
+                    _generate(image_path, plain, **kwargs)
+                    _generate(image_path, cached, row_cache=RowCache(), **kwargs)
+                except Exception as e:
+                    failures.append(f"lone pixel {kwargs}: {e!r}")
+                    continue
+                if Path(plain).read_text() != Path(cached).read_text():
+                    failures.append(f"lone pixel {kwargs}: row cache changed the output")
+
+        # A blank image, all text taken out as glyphs, on the process pool
+        image_path = os.path.join(tmp, "blank.png")
+        Image.fromarray(np.full((20, 30), 255, dtype=np.uint8)).save(image_path)
+        plain = os.path.join(tmp, "plain.gcode")
+        banded = os.path.join(tmp, "banded.gcode")
+        try:
+            _generate(image_path, plain)
+            _generate(image_path, banded, workers=2)
+        except Exception as e:
+            failures.append(f"blank image: {e!r}")
+        else:
+            if Path(plain).read_text() != Path(banded).read_text():
+                failures.append("blank image: workers changed the output")
+
+        # The compact output makes the moves of the default one, at a pixel
+        # size both write exactly
+        for name in ("text", "dense", "halftone"):
+            image_path = os.path.join(tmp, f"{name}.png")
+            synthetic(name, 120, 80).save(image_path)
+            for strategy in ("toggle", "laser-mode"):
+                for use_relative in (False, True):
+                    kwargs = dict(
+                        pixel_size_mm=0.1, use_relative=use_relative,
+                        strategy=strategy,
+                    )
+                    plain = os.path.join(tmp, "plain.gcode")
+                    compact = os.path.join(tmp, "compact.gcode")
+                    try:
+                        _generate(image_path, plain, **kwargs)
+                        _generate(image_path, compact, compact=True, **kwargs)
+                    except Exception as e:
+                        failures.append(f"{name} {kwargs}: {e!r}")
+                        continue
+                    lines = Path(plain).read_text().splitlines()
+                    if not same_toolpath(lines, Path(compact).read_text().splitlines()):
+                        failures.append(f"{name} {kwargs}: compact changed the toolpath")
+    return failures
+
+
+def measure(func, repeat):
+    """Runs func repeat times, returns median seconds, peak bytes and stats."""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+    tracemalloc.start()
+    stats = func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "seconds": statistics.median(times),
+        "peak_bytes": peak,
+        "lines": stats["lines"],
+        "bytes": stats["bytes"],
+        "machine_time": stats["seconds"],
+    }
+
+
+def run(repeat, dpis, strategies):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        gcode_path = os.path.join(tmp, "out.gcode")
+        for dpi in dpis:
+            for name, img in images(dpi):
+                image_path = os.path.join(tmp, f"{name}_{dpi}.png")
+                img.save(image_path)
+                for strategy in strategies:
+
+                    def generate(kwargs=STRATEGIES[strategy]):
+                        return _generate(
+                            image_path, gcode_path, pixel_size_mm=25.4 / dpi,
+                            **kwargs,
+                        )
+
+                    results[f"{name}/{dpi}/{strategy}"] = measure(generate, repeat)
+    return results
+
+
+def compare(results, baseline, tolerance, slack=0.001):
+    """Returns a line for every metric that got worse than the baseline.
+
+    Timings and peak memory may grow by tolerance (timings also by slack
+    seconds, below which they are noise), counts, sizes and the estimated
+    machine time not at all.
+    """
+    regressions = []
+    for case, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(case, {}).get(metric)
+            if old is None:
+                continue
+            limit = old
+            if metric == "seconds":
+                limit = max(old * (1 + tolerance), old + slack)
+            elif metric == "peak_bytes":
+                limit = old * (1 + tolerance)
+            elif metric == "machine_time":
+                limit = old + 1e-6
+            if value > limit:
+                regressions.append(
+                    "%s %s: %.6g -> %.6g" % (case, metric, old, value)
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark raster G-code generation")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dpi", type=int, nargs="+", default=[127, 254, 508])
+    parser.add_argument(
+        "--strategy", nargs="+", choices=list(STRATEGIES), default=list(STRATEGIES)
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="store as baseline")
+    parser.add_argument("--compare", action="store_true", help="check baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    failures = check()
+    for line in failures:
+        print("CHECK FAILED", line)
+    if failures:
+        return 1
+
+    results = run(args.repeat, args.dpi, args.strategy)
+    for case, metrics in results.items():
+        print(
+            case.ljust(36),
+            "  ".join("%s=%.6g" % (key, value) for key, value in metrics.items()),
+        )
+
+    if args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print("Baseline written to", args.baseline)
+    if args.compare:
+        if not args.baseline.exists():
+            print("No baseline at", args.baseline, "- run with --save first")
+            return 1
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
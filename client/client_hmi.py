@@ -2,6 +2,7 @@ from asyncio import sleep
 from asyncua.sync import Client as OPCClient
 from pathlib import Path
 import hashlib
+import json
 import shutil
 
 
@@ -147,6 +148,15 @@ class Laser:
                 mail,
             )
 
+    def generate_sheet(self, records: list[dict], layout: list[list[float]]) -> int:
+        if self._is_connected:
+            return self.gcode.call_method(
+                f"{self.nsidx}:generate_sheet",
+                json.dumps(records),
+                json.dumps(layout),
+            )
+        return -1
+
     def get_generated_gcode(self) -> str:
         if self._is_connected:
             return self.gcode.call_method(f"{self.nsidx}:get_generated_gcode")
@@ -44,9 +44,13 @@ class WorkflowState(TypedDict, total=False):
     svg_history: List[str]
     gcode_relative: Optional[bool]
     gcode_anchor: Optional[Tuple[float, float]]
+    text_as_glyphs: Optional[bool]      # Engrave <text> with glyphs instead of raster, see agents/text_agent.py
+    glyph_texts: Optional[List[Dict]]
 
     # NEW: OPC UA publish fields
     gcode_path: Optional[str]
+    gcode_stats: Optional[Dict]         # {"path", "lines", "bytes", "seconds"} of the written file
+    gcode_mode: Optional[str]           # "raster" (default) or "vector", see agents/vector_agent.py
     opcua_endpoint: Optional[str]
     opcua_publish_status: Optional[str]
 
@@ -6,6 +6,8 @@ from pathlib import Path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
 
 from asyncua import Server, ua
 from asyncua.common.methods import uamethod
@@ -17,6 +19,26 @@ from Generate_Gcode.Generate_Gcode import Generate_Gcode
 # --- ADDED ---
 # (No extra imports needed; we reuse 'os' and existing Laser instance)
 
+# G-code is rendered off the event loop, so HMI and API calls can overlap
+executor = ThreadPoolExecutor(max_workers=1)
+
+# One generation and its hand-off at a time: the program that
+# get_generated_gcode and run_generated_gcode see is the one asked for last
+generation_lock = asyncio.Lock()
+generated = {}
+
+
+async def render_in_executor(render, *args):
+    async with generation_lock:
+        result = await asyncio.get_running_loop().run_in_executor(
+            executor, render, *args
+        )
+        generated["result"] = result
+
+
+def generated_result():
+    return generated.get("result") or generate.get_result()
+
 @uamethod
 def reference(_) -> int:
     return laser.reference()
@@ -38,10 +60,13 @@ def run_code(_, codes: str) -> int:
     return laser.run_code(codes.split("\n"))
 
 @uamethod
-def generate_gcode(_, variant, title, name, division, job_title, phone, fax, mail):
-    generate.generate_gcode(
+async def generate_gcode(_, variant, title, name, division, job_title, phone, fax, mail):
+    # render() leaves the shared generator untouched, the offset is taken now
+    await render_in_executor(
+        generate.render,
+        variant,
+        generate.get_offset(),
         {
-            "variant": variant,
             "title": title,
             "name": name,
             "division": division,
@@ -49,16 +74,34 @@ def generate_gcode(_, variant, title, name, division, job_title, phone, fax, mai
             "phone": phone,
             "fax": fax,
             "mail": mail,
-        }
+        },
     )
 
+@uamethod
+async def generate_sheet(_, records: str, layout: str) -> int:
+    """
+    Generate one program for a tray of cards.
+    records: JSON list of generate_gcode info dicts (null for empty slots)
+    layout:  JSON list of [x, y] card offsets, one per tray slot
+    Returns 0 on success, -1 on failure.
+    """
+    try:
+        await render_in_executor(
+            generate.render_sheet, json.loads(records), json.loads(layout)
+        )
+        return 0
+    except Exception as e:
+        print("[generate_sheet] error:", e)
+        return -1
+
 @uamethod
 def get_generated_gcode(_):
-    return generate.get_gcode()
+    return generated_result().get_gcode()
 
 @uamethod
 def run_generated_gcode(_):
-    return laser.run_code(generate.get_gcode().split("\n"))
+    result = generated_result()
+    return laser.run_code(result.lines(), result.count_lines())
 
 @uamethod
 def stop(_):
@@ -245,6 +288,17 @@ async def main():
         ],
     )
 
+    await gcode.add_method(
+        ua.NodeId("generate_sheet", idx),
+        ua.QualifiedName("generate_sheet", idx),
+        generate_sheet,
+        [
+            ua.Argument(" Records", ua.NodeId(ua.ObjectIds.String), -1),
+            ua.Argument(" Layout", ua.NodeId(ua.ObjectIds.String), -1),
+        ],
+        [ua.VariantType.Int64],
+    )
+
     await control.add_method(
         ua.NodeId("connect", idx),
         ua.QualifiedName("connect", idx),
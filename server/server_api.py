@@ -417,35 +417,17 @@ def node_gcode_generate(job_id: str, opts: GcodeOptions = Body(default=GcodeOpti
     st["gcode_relative"] = bool(opts.gcode_relative)
     st["gcode_anchor"] = tuple(opts.gcode_anchor or (0.0, 0.0))
 
-    out_state = gcode_generation_node(st)  # should return gcode_content and/or gcode_path
+    out_state = gcode_generation_node(st)  # streams to gcode_path, returns path + stats
     st.update(out_state)
 
-    # Ensure we have gcode content
-    gcode_text = st.get("gcode_content")
-    # Ensure we have a path
     gpath = st.get("gcode_path")
-    if not gpath:
-        # fallback next to bw image
-        gpath = st["bw_path"].replace("_bw.png", ".gcode")
-        st["gcode_path"] = gpath
-
-    # If the file does not exist but we have content, write it.
-    try:
-        if gcode_text and (not Path(gpath).exists()):
-            Path(gpath).parent.mkdir(parents=True, exist_ok=True)
-            Path(gpath).write_text(gcode_text, encoding="utf-8")
-    except Exception as e:
-        raise HTTPException(500, f"Failed to write G-code to '{gpath}': {e}")
-
-    # If still no file, error with a helpful message
-    if not Path(gpath).exists():
+    if not gpath or not Path(gpath).exists():
         raise HTTPException(
             500,
-            f"G-code file '{gpath}' not found and no gcode_content to write. "
-            "Check gcode_generation_node output."
+            f"G-code file '{gpath}' not found. Check gcode_generation_node output."
         )
 
-    return {"gcode_path": st["gcode_path"]}
+    return {"gcode_path": gpath, "gcode_stats": st.get("gcode_stats")}
 
 # 9) G-code preview image (no GUI)
 @app.get("/node/{job_id}/gcode/preview")
@@ -454,24 +436,10 @@ def node_gcode_preview(job_id: str):
     st = job["state"]
 
     gpath = st.get("gcode_path")
-    gtext = st.get("gcode_content")
-
-    if not gpath and not gtext:
+    if not gpath:
         raise HTTPException(400, "No G-code; run /gcode/generate first")
-
-    # If we have content but no file (or the file has been removed), materialize it
-    if (not gpath) or (gpath and not Path(gpath).exists()):
-        if not gtext:
-            raise HTTPException(500, "gcode_path missing or not found on disk, and no gcode_content in state.")
-        # write a temp file inside the job dir
-        job_dir = Path(job["dir"])
-        job_dir.mkdir(parents=True, exist_ok=True)
-        gpath = str(job_dir / "preview_tmp.gcode")
-        try:
-            Path(gpath).write_text(gtext, encoding="utf-8")
-            st["gcode_path"] = gpath  # keep state coherent
-        except Exception as e:
-            raise HTTPException(500, f"Failed to write temporary G-code for preview: {e}")
+    if not Path(gpath).exists():
+        raise HTTPException(500, f"G-code file '{gpath}' not found on disk.")
 
     out_png = Path(job["dir"]) / "gcode_preview.png"
     try: